@@ -0,0 +1,255 @@
+import argparse
+import ast
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from detection import CONF_THRESHOLD, IMGSZ, Detections, YoloDetector, empty_detections
+from models import DEFAULT_WEIGHTS, registry
+
+# The weights file picks the backend: .pt runs in PyTorch through
+# ultralytics, .onnx in ONNX Runtime. `export` writes best.onnx and the
+# INT8 quantized best.int8.onnx next to best.pt.
+BACKENDS = ("torch", "onnx", "onnx-int8")
+BACKEND_SUFFIXES = {"torch": ".pt", "onnx": ".onnx", "onnx-int8": ".int8.onnx"}
+
+# Same defaults as ultralytics predict, so every backend returns the same boxes
+IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+LETTERBOX_COLOUR = 114
+# Offsets boxes of different classes apart so one NMS call stays per class
+CLASS_OFFSET = 7680
+
+WEIGHTS_HELP = "YOLO weights: .pt for PyTorch, .onnx or .int8.onnx (see backends.py export) for ONNX Runtime"
+
+
+def backend_weights(weights, backend):
+    # best.pt -> best.onnx / best.int8.onnx
+    root = weights
+    for suffix in sorted(BACKEND_SUFFIXES.values(), key=len, reverse=True):
+        if root.endswith(suffix):
+            root = root[:-len(suffix)]
+            break
+    return root + BACKEND_SUFFIXES[backend]
+
+
+def letterbox(images, imgsz=IMGSZ):
+    # Resizes each image into an imgsz square keeping its aspect ratio,
+    # padded with grey, and returns the whole batch as one normalized NCHW
+    # float32 RGB blob plus the per-image scale and (left, top) padding
+    # needed to map boxes back. Only the resize is per image; channel flip,
+    # transpose and scaling run once over the batch.
+    n = len(images)
+    batch = np.full((n, imgsz, imgsz, 3), LETTERBOX_COLOUR, dtype=np.uint8)
+    scales = np.empty(n, dtype=np.float32)
+    pads = np.empty((n, 2), dtype=np.float32)
+    for i, image in enumerate(images):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        height, width = image.shape[:2]
+        scale = min(imgsz / height, imgsz / width)
+        new_width, new_height = round(width * scale), round(height * scale)
+        left, top = (imgsz - new_width) // 2, (imgsz - new_height) // 2
+        if (new_width, new_height) != (width, height):
+            image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+        batch[i, top:top + new_height, left:left + new_width] = image
+        scales[i] = scale
+        pads[i] = left, top
+
+    blob = np.empty((n, 3, imgsz, imgsz), dtype=np.float32)
+    np.multiply(batch[..., ::-1].transpose(0, 3, 1, 2), np.float32(1 / 255), out=blob, casting="unsafe")
+    return blob, scales, pads
+
+
+def unletterbox(boxes, scale, pad, shape):
+    # Letterboxed x1 y1 x2 y2 back to pixels of the original image, in place
+    boxes -= np.tile(pad, 2)
+    boxes /= scale
+    height, width = shape[:2]
+    np.clip(boxes, 0, [width, height, width, height], out=boxes)
+    return boxes
+
+
+def postprocess_end_to_end(output, scales, pads, shapes, names, conf=CONF_THRESHOLD):
+    # YOLOv10 exports are NMS free: (N, max detections, 6) rows of
+    # x1 y1 x2 y2 confidence class in letterboxed pixels
+    results = []
+    for prediction, scale, pad, shape in zip(output, scales, pads, shapes):
+        prediction = prediction[prediction[:, 4] >= conf]
+        boxes = unletterbox(prediction[:, :4].astype(np.float32), scale, pad, shape)
+        results.append(Detections(boxes, prediction[:, 4].astype(np.float32),
+                                  prediction[:, 5].astype(np.int64), names))
+    return results
+
+
+def postprocess(output, scales, pads, shapes, names, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD,
+                max_detections=MAX_DETECTIONS):
+    # YOLOv8 head output (N, 4 + classes, anchors) with boxes as centre x,
+    # centre y, width, height in letterboxed pixels -> one Detections per image
+    if output.shape[-1] == 6:
+        return postprocess_end_to_end(output, scales, pads, shapes, names, conf)
+    results = []
+    for prediction, scale, pad, shape in zip(output, scales, pads, shapes):
+        prediction = prediction.T
+        scores = prediction[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences >= conf
+        if not keep.any():
+            results.append(empty_detections(names))
+            continue
+        xywh = prediction[keep, :4]
+        class_ids = class_ids[keep]
+        confidences = confidences[keep]
+
+        # NMSBoxes takes x, y, width, height
+        offset_boxes = xywh.copy()
+        offset_boxes[:, :2] -= offset_boxes[:, 2:] / 2
+        offset_boxes[:, :2] += (class_ids * CLASS_OFFSET)[:, None]
+        index = cv2.dnn.NMSBoxes(offset_boxes.tolist(), confidences.tolist(), conf, iou, top_k=max_detections)
+        index = np.asarray(index, dtype=np.int64).reshape(-1)
+
+        boxes = np.concatenate([xywh[index, :2] - xywh[index, 2:] / 2,
+                                xywh[index, :2] + xywh[index, 2:] / 2], axis=1)
+        boxes = unletterbox(boxes, scale, pad, shape)
+        results.append(Detections(boxes.astype(np.float32), confidences[index].astype(np.float32),
+                                  class_ids[index].astype(np.int64), names))
+    return results
+
+
+class OnnxModel:
+    # A YOLO model exported to ONNX, run by ONNX Runtime on the CPU. Called
+    # like an ultralytics model, but returns Detections directly.
+    def __init__(self, path, threads=None, providers=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, options, providers=providers or ["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+        # ultralytics stores the class names and input size in the metadata
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        names = ast.literal_eval(metadata.get("names", "{}"))
+        self.names = {int(k): str(v).lower() for k, v in names.items()}
+        imgsz = ast.literal_eval(metadata.get("imgsz", str([IMGSZ, IMGSZ])))
+        self.imgsz = int(imgsz[0])
+        # A static batch dimension means the model was exported without dynamic=True
+        batch, _, height, width = self.session.get_inputs()[0].shape
+        self.batch_size = batch if isinstance(batch, int) else None
+        # Likewise a static height and width only accept the exported imgsz
+        self.dynamic_imgsz = not (isinstance(height, int) and isinstance(width, int))
+
+    def __call__(self, images, conf=CONF_THRESHOLD, iou=IOU_THRESHOLD, imgsz=None, verbose=False):
+        # A different imgsz (a multiple of 32) needs a model exported with dynamic=True
+        if isinstance(images, np.ndarray):
+            images = [images]
+        images = list(images)
+        blob, scales, pads = letterbox(images, imgsz or self.imgsz)
+        if self.batch_size is None:
+            output = self.session.run(None, {self.input_name: blob})[0]
+        else:
+            output = np.concatenate([self.session.run(None, {self.input_name: blob[i:i + self.batch_size]})[0]
+                                     for i in range(0, len(blob), self.batch_size)])
+        return postprocess(output, scales, pads, [image.shape for image in images], self.names, conf, iou)
+
+
+class OnnxDetector:
+    # Same interface as YoloDetector: list of frames -> list of Detections
+    def __init__(self, model, conf=CONF_THRESHOLD, imgsz=None):
+        self.model = model
+        self.conf = conf
+        self.imgsz = imgsz
+        self.names = model.names
+
+    @property
+    def dynamic_imgsz(self):
+        return self.model.dynamic_imgsz
+
+    def __call__(self, frames):
+        return self.model(list(frames), conf=self.conf, imgsz=self.imgsz)
+
+
+def load_model(weights):
+    # Used by the model registry; ultralytics and onnxruntime are only
+    # imported for the backend that is actually used
+    if weights.endswith(".onnx"):
+        return OnnxModel(weights)
+    from ultralytics import YOLO
+    return YOLO(weights)
+
+
+def load_detector(weights=DEFAULT_WEIGHTS, conf=CONF_THRESHOLD, timeout=None):
+    model = registry.get(weights, timeout)
+    if isinstance(model, OnnxModel):
+        return OnnxDetector(model, conf=conf)
+    return YoloDetector(model, conf=conf)
+
+
+class CalibrationImages:
+    # Feeds letterboxed images to onnxruntime's static quantization
+    def __init__(self, paths, input_name, imgsz):
+        self.paths = iter(paths)
+        self.input_name = input_name
+        self.imgsz = imgsz
+
+    def get_next(self):
+        for path in self.paths:
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is not None:
+                return {self.input_name: letterbox([image], self.imgsz)[0]}
+        return None
+
+
+def export(weights=DEFAULT_WEIGHTS, imgsz=IMGSZ, int8=True, calibration=None, calibration_images=200):
+    # One-time conversion of the PyTorch weights. INT8 uses static
+    # quantization when calibration images are given, which keeps accuracy
+    # closer to FP32, and dynamic quantization of the weights otherwise.
+    from ultralytics import YOLO
+
+    onnx_path = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    target = backend_weights(weights, "onnx")
+    if os.path.abspath(onnx_path) != os.path.abspath(target):
+        os.replace(onnx_path, target)
+    written = [target]
+    if not int8:
+        return written
+
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+    int8_path = backend_weights(weights, "onnx-int8")
+    if calibration:
+        from batch import collect_inputs
+        paths = [path for path, _ in collect_inputs([calibration])[:calibration_images]]
+        input_name = OnnxModel(target).input_name
+        quantize_static(target, int8_path, CalibrationImages(paths, input_name, imgsz),
+                        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8, per_channel=True)
+    else:
+        quantize_dynamic(target, int8_path, weight_type=QuantType.QUInt8)
+    written.append(int8_path)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export YOLO weights to ONNX and INT8 ONNX for CPU inference.")
+    parser.add_argument("weights", nargs="?", default=DEFAULT_WEIGHTS)
+    parser.add_argument("--imgsz", type=int, default=IMGSZ)
+    parser.add_argument("--no-int8", action="store_true", help="only export the FP32 ONNX model")
+    parser.add_argument("--calibration", metavar="DIR", help="images for static INT8 calibration "
+                        "(default: dynamic quantization)")
+    parser.add_argument("--calibration-images", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    for path in export(args.weights, args.imgsz, not args.no_int8, args.calibration, args.calibration_images):
+        print(f"wrote {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+from PIL import Image
+
+from cache import ResultCache, cache_key, enhancement_params
+from enhancement import GAMMA_MODES, Enhancer, content_hash
+from tracing import enable_from_args, span, tracer
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff")
+MANIFEST_NAME = ".batch_done"
+
+# Rough number of full-frame BGR buffers alive while one image is enhanced
+# (decoded, gamma corrected, YCrCb, split planes, merged, output).
+BUFFERS_PER_IMAGE = 6
+
+
+def source_names(paths, root):
+    # Names relative to `root`, the common directory when root is None;
+    # os.path.commonpath fails for paths on different drives
+    if root is None:
+        try:
+            root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+        except ValueError:
+            raise ValueError("listed images on different drives share no common directory") from None
+    return [os.path.relpath(os.path.abspath(path), root) for path in paths]
+
+
+def collect_inputs(sources):
+    # Returns (path, relative output name) pairs. A source can be a directory
+    # (walked recursively), an image file or a text file listing one path per line.
+    # Each name depends only on its own source, so a resume with some of the
+    # sources finds the same names: a directory gives <directory name>/<relative
+    # path>, an image its file name, and a listing paths relative to the
+    # directory its images share. Two different files with the same name are
+    # rejected rather than written over each other.
+    inputs = []
+    seen = {}
+    for source in sources:
+        if os.path.isdir(source):
+            paths = []
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                paths += [os.path.join(root, name) for name in sorted(files)
+                          if name.lower().endswith(IMAGE_EXTENSIONS)]
+            prefix = os.path.basename(os.path.abspath(source))
+            names = [os.path.join(prefix, name) for name in source_names(paths, source)]
+        elif source.lower().endswith(IMAGE_EXTENSIONS):
+            paths, names = [source], [os.path.basename(source)]
+        else:
+            with open(source) as listing:
+                paths = [line.strip() for line in listing if line.strip()]
+            names = source_names(paths, None) if paths else []
+
+        for path, name in zip(paths, names):
+            if name in seen:
+                # The same file given twice is processed once
+                if os.path.abspath(seen[name]) == os.path.abspath(path):
+                    continue
+                raise ValueError(f"{path} and {seen[name]} would both be written as {name}")
+            seen[name] = path
+            inputs.append((path, name))
+    return inputs
+
+
+def estimate_image_bytes(path):
+    # Reads only the header, the pixels are decoded inside the worker.
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+    except Exception:
+        return 0
+    return width * height * 3 * BUFFERS_PER_IMAGE
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as manifest:
+        return {line.rstrip("\n") for line in manifest if line.strip()}
+
+
+_enhancer = None
+_cache = None
+
+
+def init_worker(gamma_mode="random", gamma=0.75, seed=0, cache_dir=None, trace=False):
+    global _enhancer, _cache
+    # One OpenCV thread per process, the pool provides the parallelism.
+    cv2.setNumThreads(1)
+    # Workers send their spans back with each result, see run_batch
+    if trace:
+        tracer.enable(histograms=False)
+    _enhancer = Enhancer(gamma_mode=gamma_mode, gamma=gamma, seed=seed)
+    # Every worker opens the same cache directory; writes are atomic renames.
+    # A small memory tier is enough since archives are rarely read twice per run.
+    if cache_dir and _enhancer.deterministic:
+        _cache = ResultCache(cache_dir, memory_max_bytes=0)
+
+
+def enhance_file(path, output_path):
+    with span("batch.decode"):
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"Could not decode {path}")
+
+    key = None
+    if _cache is not None:
+        key = cache_key("enhancement", content_hash(image), **enhancement_params(_enhancer))
+        cached = _cache.get(key)
+        enhanced = cached["enhanced"] if cached is not None else None
+    if key is None or enhanced is None:
+        enhanced = _enhancer.enhance(image)
+        if key is not None:
+            _cache.put(key, {"enhanced": enhanced})
+
+    # Write to a temporary name first so an interrupted run never leaves a
+    # truncated output behind.
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    root, ext = os.path.splitext(output_path)
+    tmp_path = f"{root}.partial{ext}"
+    with span("batch.write"):
+        if not cv2.imwrite(tmp_path, enhanced):
+            raise ValueError(f"Could not write {output_path}")
+    os.replace(tmp_path, output_path)
+    return image.shape, tracer.drain() if tracer.enabled else None
+
+
+def run_batch(inputs, output_dir, workers=None, max_inflight=None, memory_mb=1024,
+              resume=True, report_every=100, gamma_mode="random", gamma=0.75, seed=0, cache_dir=None):
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    max_inflight = max_inflight or workers * 2
+    budget = memory_mb * 1024 * 1024
+
+    done = load_manifest(output_dir) if resume else set()
+    pending = [(path, name) for path, name in inputs if name not in done]
+    skipped = len(inputs) - len(pending)
+    if skipped:
+        print(f"Resuming: {skipped} images already done, {len(pending)} remaining")
+
+    processed = 0
+    failed = 0
+    start = time.perf_counter()
+    inflight = {}
+    inflight_bytes = 0
+    queue = iter(pending)
+    next_item = next(queue, None)
+
+    with open(os.path.join(output_dir, MANIFEST_NAME), "a" if resume else "w") as manifest, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                initargs=(gamma_mode, gamma, seed, cache_dir, tracer.enabled)) as pool:
+        while next_item is not None or inflight:
+            # Submit while both the in-flight count and the memory budget allow it.
+            # A single image larger than the budget still runs, but on its own.
+            while next_item is not None and len(inflight) < max_inflight:
+                path, name = next_item
+                cost = estimate_image_bytes(path)
+                if inflight and inflight_bytes + cost > budget:
+                    break
+                future = pool.submit(enhance_file, path, os.path.join(output_dir, name))
+                inflight[future] = (name, cost)
+                inflight_bytes += cost
+                next_item = next(queue, None)
+
+            finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, cost = inflight.pop(future)
+                inflight_bytes -= cost
+                try:
+                    _, events = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Failed {name}: {e}", file=sys.stderr)
+                    continue
+                if events:
+                    tracer.merge(events)
+                manifest.write(name + "\n")
+                processed += 1
+                if report_every and processed % report_every == 0:
+                    manifest.flush()
+                    elapsed = time.perf_counter() - start
+                    print(f"{processed}/{len(pending)} images, {processed / elapsed:.2f} images/sec")
+
+    elapsed = time.perf_counter() - start
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"Done: {processed} enhanced, {failed} failed, {skipped} skipped in {elapsed:.1f}s ({rate:.2f} images/sec)")
+    return processed, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Enhance a directory or list of images without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="image directories, image files or text files listing image paths")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--max-inflight", type=int, default=None, help="maximum queued images (default: 2 x workers)")
+    parser.add_argument("--memory-mb", type=int, default=1024, help="memory budget for images in flight")
+    parser.add_argument("--no-resume", action="store_true", help="ignore the manifest of a previous run")
+    parser.add_argument("--gamma-mode", choices=GAMMA_MODES, default="random",
+                        help="how gamma is chosen; anything but random gives reproducible output")
+    parser.add_argument("--gamma", type=float, default=0.75, help="gamma for --gamma-mode fixed")
+    parser.add_argument("--seed", type=int, default=0, help="seed for --gamma-mode content")
+    parser.add_argument("--cache", metavar="DIR", help="reuse enhanced frames from this result cache "
+                        "(ignored with --gamma-mode random)")
+    parser.add_argument("--trace", metavar="PATH", help="write a Chrome trace of every stage to PATH; "
+                        "SIGUSR1 prints per-stage timings while running")
+    parser.add_argument("--report-every", type=int, default=100, help="print throughput every N images")
+    args = parser.parse_args(argv)
+    enable_from_args(args.trace)
+
+    try:
+        inputs = collect_inputs(args.inputs)
+    except ValueError as e:
+        parser.error(str(e))
+    if not inputs:
+        parser.error("no images found")
+
+    _, failed = run_batch(
+        inputs, args.output,
+        workers=args.workers,
+        max_inflight=args.max_inflight,
+        memory_mb=args.memory_mb,
+        resume=not args.no_resume,
+        report_every=args.report_every,
+        gamma_mode=args.gamma_mode,
+        gamma=args.gamma,
+        seed=args.seed,
+        cache_dir=args.cache,
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from backends import BACKENDS, backend_weights, load_detector
+from batch import collect_inputs
+from detection import CONF_THRESHOLD, count_objects
+from frames import Frame
+from synthetic import synthetic_frame
+from tracking import iou_matrix
+
+# A box agrees with the reference when a box of the same class overlaps it this much
+PARITY_IOU = 0.5
+# Share of reference boxes another backend must reproduce, and of its own boxes
+# the reference must confirm (INT8 gets its own bar)
+MIN_MATCH = {"onnx": 0.98, "onnx-int8": 0.9}
+
+
+def load_frames(inputs, n, size):
+    if inputs:
+        return [Frame.from_path(path).bgr for path, _ in collect_inputs(inputs)[:n]]
+    height, width = size
+    return [synthetic_frame(height, width, ("lowlight", "fog")[i % 2], seed=i) for i in range(n)]
+
+
+def compare(reference, candidate):
+    # Share of reference boxes the candidate reproduces (recall), share of
+    # candidate boxes the reference confirms (precision), and the largest
+    # confidence difference between matched boxes. With no boxes on a side
+    # there is nothing to miss, so an empty reference and candidate agree.
+    found = n_reference = confirmed = n_candidate = 0
+    conf_diff = 0.0
+    for ref, new in zip(reference, candidate):
+        n_reference += len(ref.boxes)
+        n_candidate += len(new.boxes)
+        if len(ref.boxes) == 0 or len(new.boxes) == 0:
+            continue
+        iou = iou_matrix(ref.boxes, new.boxes)
+        iou[ref.class_ids[:, None] != new.class_ids[None, :]] = 0
+        confirmed += int((iou.max(axis=0) >= PARITY_IOU).sum())
+        best = iou.argmax(axis=1)
+        good = iou[np.arange(len(best)), best] >= PARITY_IOU
+        found += int(good.sum())
+        if good.any():
+            diff = np.abs(ref.confidences[good] - new.confidences[best[good]]).max()
+            conf_diff = max(conf_diff, float(diff))
+    recall = found / n_reference if n_reference else 1.0
+    precision = confirmed / n_candidate if n_candidate else 1.0
+    return recall, precision, conf_diff
+
+
+def throughput(detector, frames, batch_size, repeats):
+    detector(frames[:batch_size])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(frames), batch_size):
+            detector(frames[i:i + batch_size])
+    return repeats * len(frames) / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that every detector backend returns the same vehicles "
+                                                 "and compare their throughput.")
+    parser.add_argument("inputs", nargs="*", help="images or directories (default: synthetic frames)")
+    parser.add_argument("--weights", default="best.pt", help="PyTorch weights; the ONNX files are found next to it")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("-n", "--frames", type=int, default=32)
+    parser.add_argument("--size", type=int, nargs=2, default=(720, 1280), metavar=("HEIGHT", "WIDTH"))
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--conf", type=float, default=CONF_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    frames = load_frames(args.inputs, args.frames, args.size)
+    backends = []
+    for backend in args.backends:
+        path = backend_weights(args.weights, backend)
+        if not os.path.exists(path):
+            print(f"{backend:<10} skipped, {path} not found (run: python backends.py {args.weights})")
+            continue
+        backends.append((backend, load_detector(path, conf=args.conf)))
+    if not backends:
+        return 1
+
+    reference_name, reference_detector = backends[0]
+    reference = reference_detector(frames)
+    failed = False
+    header = "".join(f"{f'batch {b} fps':>14}" for b in args.batch_size)
+    print(f"{'backend':<10}{header}{'recall':>8}{'prec':>8}{'max dconf':>11}  counts")
+    for backend, detector in backends:
+        detections = reference if backend == reference_name else detector(frames)
+        recall, precision, conf_diff = compare(reference, detections)
+        counts = {name: 0 for name in ("bus", "car", "motor", "truck")}
+        for frame_detections in detections:
+            for name, n in count_objects(frame_detections).items():
+                counts[name] += n
+        fps = "".join(f"{throughput(detector, frames, b, args.repeats):>14.1f}" for b in args.batch_size)
+        flag = ""
+        if min(recall, precision) < MIN_MATCH.get(backend, 1.0) and backend != reference_name:
+            flag = "  PARITY FAILED"
+            failed = True
+        print(f"{backend:<10}{fps}{recall:>8.3f}{precision:>8.3f}{conf_diff:>11.3f}  {counts}{flag}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
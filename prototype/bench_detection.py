@@ -0,0 +1,81 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from detection import CONF_THRESHOLD, BatchDetectionService, StubDetector, YoloDetector, count_objects
+from models import registry
+
+
+def per_image_legacy(model, frames, conf):
+    # The original object detection page path: one model call per frame and
+    # a .cpu().numpy() round trip for every box.
+    for frame in frames:
+        results = model(frame, conf=conf, verbose=False)
+        object_counts = {'bus': 0, 'car': 0, 'motor': 0, 'truck': 0}
+        for result in results:
+            for box in result.boxes:
+                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
+                cls = int(box.cls[0])
+                float(box.conf[0])
+                class_name = result.names[cls].lower()
+                if class_name in object_counts:
+                    object_counts[class_name] += 1
+
+
+def per_image(detector, frames):
+    for frame in frames:
+        count_objects(detector([frame])[0])
+
+
+def batched(detector, frames, batch_size, max_wait, clients):
+    # Several clients submit concurrently, as the stream and server do
+    with BatchDetectionService(detector, max_batch_size=batch_size, max_wait=max_wait) as service:
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            for detections in pool.map(service.detect, frames):
+                count_objects(detections)
+        return service.batches
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare per-image and micro-batched detection throughput.")
+    parser.add_argument("--weights", help="YOLO weights; without them a stub detector is used")
+    parser.add_argument("-n", "--frames", type=int, default=64)
+    parser.add_argument("--size", type=int, nargs=2, default=(720, 1280), metavar=("HEIGHT", "WIDTH"))
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-wait", type=float, default=0.01)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--conf", type=float, default=CONF_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    height, width = args.size
+    frames = [rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8) for _ in range(args.frames)]
+
+    if args.weights:
+        model = registry.get(args.weights)
+        detector = YoloDetector(model, conf=args.conf)
+        legacy_time, _ = timed(per_image_legacy, model, frames, args.conf)
+        print(f"per-image (legacy loop): {args.frames / legacy_time:8.2f} frames/sec")
+    else:
+        # Fixed per-call overhead plus per-frame cost, roughly how a CPU model scales
+        detector = StubDetector(call_delay=0.02, frame_delay=0.005, conf=args.conf)
+
+    single_time, _ = timed(per_image, detector, frames)
+    print(f"per-image:               {args.frames / single_time:8.2f} frames/sec")
+
+    batch_time, batches = timed(batched, detector, frames, args.batch_size, args.max_wait, args.clients)
+    print(f"batched:                 {args.frames / batch_time:8.2f} frames/sec "
+          f"({batches} batches, {args.frames / max(batches, 1):.1f} frames/batch)")
+    print(f"speedup:                 {single_time / batch_time:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from enhancement import Enhancer
+# The original per-call implementation: rebuilds the table and CLAHE object
+from golden_enhancement import reference_enhancement
+
+RESOLUTIONS = {
+    "720p": (720, 1280),
+    "1080p": (1080, 1920),
+    "4K": (2160, 3840),
+}
+
+
+def time_per_frame(fn, image, gammas):
+    fn(image, gammas[0])
+    start = time.perf_counter()
+    for gamma in gammas:
+        fn(image, gamma)
+    return (time.perf_counter() - start) / len(gammas) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-frame cost of apply_enhancement with and without cached tables.")
+    parser.add_argument("-n", "--frames", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    gamma_rng = random.Random(args.seed)
+    # A video-like gamma sequence that revisits the same values
+    gammas = [round(gamma_rng.uniform(0.5, 1.0), 2) for _ in range(args.frames)]
+    enhancer = Enhancer()
+
+    print(f"{'resolution':<12}{'uncached ms':>14}{'cached ms':>12}{'speedup':>10}")
+    for name, (height, width) in RESOLUTIONS.items():
+        image = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        baseline = time_per_frame(reference_enhancement, image, gammas)
+        cached = time_per_frame(enhancer.enhance, image, gammas)
+        print(f"{name:<12}{baseline:>14.2f}{cached:>12.2f}{baseline / cached:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from benchmark import max_rss_mb
+from enhancement import Enhancer
+from frames import Frame, cv2_to_pil
+
+
+def legacy_path(path, enhancer):
+    # The conversions the GUI made per image before Frame: PIL decode,
+    # np.array copy, a PIL round trip of the enhanced image, a full-size
+    # thumbnail copy per display and a second BGR conversion for detection.
+    original = Image.open(path)
+    original.load()
+    cv_image = cv2.cvtColor(np.array(original), cv2.COLOR_RGB2BGR)
+    gray_original = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
+    enhanced_cv = enhancer.enhance(cv_image)
+    gray_enhanced = cv2.cvtColor(enhanced_cv, cv2.COLOR_BGR2GRAY)
+    enhanced = cv2_to_pil(enhanced_cv)
+    for image in (original, original, enhanced, enhanced):
+        display = image.copy()
+        display.thumbnail((380, 280), Image.Resampling.LANCZOS)
+    detect_input = cv2.cvtColor(np.array(enhanced), cv2.COLOR_RGB2BGR)
+    detected = cv2_to_pil(detect_input.copy())
+    display = detected.copy()
+    display.thumbnail((380, 280), Image.Resampling.LANCZOS)
+    return gray_original, gray_enhanced
+
+
+def frame_path(path, enhancer):
+    original = Frame.from_path(path)
+    original.thumbnail()
+    gray_original = original.gray
+    enhanced = Frame(enhancer.enhance(original.bgr))
+    enhanced.thumbnail()
+    gray_enhanced = enhanced.gray
+    detected = Frame(enhanced.bgr.copy())
+    detected.thumbnail()
+    return gray_original, gray_enhanced
+
+
+PATHS = {"legacy": legacy_path, "frame": frame_path}
+
+
+def measure(mode, path, warmup_path):
+    # Warm up on a tiny image so imports and caches are not counted, then
+    # process the real image once: the growth of peak RSS is its footprint.
+    enhancer = Enhancer(gamma_mode="fixed")
+    PATHS[mode](warmup_path, enhancer)
+    baseline = max_rss_mb()
+    # tracemalloc sees numpy and OpenCV buffers but not PIL's own memory
+    tracemalloc.start()
+    PATHS[mode](path, enhancer)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    after = max_rss_mb()
+    return {
+        "mode": mode,
+        "peak_traced_mb": peak / 2 ** 20,
+        "peak_rss_growth_mb": None if baseline is None else after - baseline,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Peak memory per image for the legacy PIL path and the Frame path.")
+    parser.add_argument("image", nargs="?", help="input image (default: a synthetic 4K frame)")
+    parser.add_argument("--mode", choices=PATHS, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.gettempdir()
+    rng = np.random.default_rng(0)
+    warmup_path = os.path.join(workdir, "bench_frames_warmup.png")
+    cv2.imwrite(warmup_path, rng.integers(0, 80, size=(64, 64, 3), dtype=np.uint8))
+    path = args.image
+    if path is None:
+        path = os.path.join(workdir, "bench_frames_4k.png")
+        cv2.imwrite(path, rng.integers(0, 80, size=(2160, 3840, 3), dtype=np.uint8))
+
+    if args.mode:
+        print(json.dumps(measure(args.mode, path, warmup_path)))
+        return
+
+    # Each path runs in a fresh process so peak RSS is not shared
+    height, width = cv2.imread(path).shape[:2]
+    frame_mb = height * width * 3 / 2 ** 20
+    results = {}
+    for mode in PATHS:
+        output = subprocess.run([sys.executable, __file__, path, "--mode", mode],
+                                check=True, capture_output=True, text=True).stdout
+        results[mode] = json.loads(output)
+
+    print(f"{width}x{height}, one BGR frame = {frame_mb:.1f} MB")
+    for mode, result in results.items():
+        growth = result["peak_rss_growth_mb"]
+        rss = "    n/a" if growth is None else f"{growth:7.1f} MB ({growth / frame_mb:4.1f} frames)"
+        print(f"{mode:<8} peak RSS growth {rss}  peak numpy/OpenCV {result['peak_traced_mb']:7.1f} MB")
+    legacy, frame = results["legacy"]["peak_rss_growth_mb"], results["frame"]["peak_rss_growth_mb"]
+    if legacy and frame is not None:
+        print(f"peak RSS growth reduced by {1 - frame / legacy:.0%}")
+
+
+if __name__ == "__main__":
+    main()
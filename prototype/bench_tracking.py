@@ -0,0 +1,158 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from detection import Detections, StubDetector
+from synthetic import road_scene
+from tracking import MIN_HITS, PROPAGATION_MODES, KeyframeDetector, iou_matrix
+
+MATCH_IOU = 0.5
+
+
+def moving_vehicles(n_frames, height, width, n_vehicles, seed=0):
+    # Textured boxes driving across a static road scene. Returns the frames
+    # and, per frame, the ground truth (boxes, class ids), plus the number of
+    # distinct vehicles per class id.
+    rng = np.random.default_rng(seed)
+    background = road_scene(height, width, rng)
+    vehicles = []
+    for _ in range(n_vehicles):
+        w = int(rng.integers(width // 16, width // 8))
+        h = int(w * rng.uniform(0.5, 0.8))
+        texture = rng.integers(0, 256, size=(h // 4 + 1, w // 4 + 1, 3), dtype=np.uint8)
+        texture = cv2.resize(texture, (w, h), interpolation=cv2.INTER_NEAREST)
+        texture = cv2.GaussianBlur(texture, (5, 5), 0)
+        speed = rng.uniform(2, 8) * rng.choice([-1, 1])
+        vehicles.append({
+            "class_id": int(rng.integers(len(StubDetector.names))),
+            "texture": texture,
+            "start": int(rng.integers(0, max(1, n_frames - 60))),
+            "x": -w if speed > 0 else width,
+            "y": int(rng.integers(height // 3, height - h)),
+            "speed": speed,
+        })
+
+    frames, truth = [], []
+    unique = {}
+    for index in range(n_frames):
+        frame = background.copy()
+        boxes, class_ids = [], []
+        for v in vehicles:
+            h, w = v["texture"].shape[:2]
+            x = int(round(v["x"] + v["speed"] * (index - v["start"])))
+            if index < v["start"] or x + w <= 0 or x >= width:
+                continue
+            x1, x2 = max(x, 0), min(x + w, width)
+            y = v["y"]
+            frame[y:y + h, x1:x2] = v["texture"][:, x1 - x:x2 - x]
+            boxes.append((x1, y, x2, y + h))
+            class_ids.append(v["class_id"])
+            if not v.get("seen"):
+                v["seen"] = True
+                unique[v["class_id"]] = unique.get(v["class_id"], 0) + 1
+        frames.append(frame)
+        truth.append((np.array(boxes, dtype=np.float32).reshape(-1, 4), np.array(class_ids, dtype=np.int64)))
+    return frames, truth, unique
+
+
+class GroundTruthDetector:
+    # Returns the ground truth for a frame, jittered, after a simulated
+    # inference time, so tracking accuracy is measured against known boxes.
+    names = StubDetector.names
+
+    def __init__(self, frames, truth, delay, jitter=2.0, seed=0):
+        self.truth = {id(frame): boxes for frame, boxes in zip(frames, truth)}
+        self.delay = delay
+        self.jitter = jitter
+        self.rng = np.random.default_rng(seed)
+        self.calls = 0
+
+    def __call__(self, frames):
+        frames = list(frames)
+        self.calls += len(frames)
+        if self.delay:
+            time.sleep(self.delay * len(frames))
+        results = []
+        for frame in frames:
+            boxes, class_ids = self.truth[id(frame)]
+            boxes = boxes + self.rng.normal(0, self.jitter, size=boxes.shape).astype(np.float32)
+            results.append(Detections(boxes, np.full(len(boxes), 0.9, dtype=np.float32), class_ids, self.names))
+        return results
+
+
+def score(detections, boxes, class_ids):
+    # Matched ground truth boxes and predicted boxes at IoU >= MATCH_IOU, same class
+    if len(boxes) == 0 or len(detections.boxes) == 0:
+        return 0, 0
+    iou = iou_matrix(boxes, detections.boxes)
+    iou[class_ids[:, None] != detections.class_ids[None, :]] = 0
+    good = iou >= MATCH_IOU
+    return int(good.any(axis=1).sum()), int(good.any(axis=0).sum())
+
+
+def run_config(frames, truth, unique, delay, **options):
+    detector = GroundTruthDetector(frames, truth, delay)
+    keyframe_detector = KeyframeDetector(detector, **options)
+    found = predicted_good = predicted = expected = 0
+    start = time.perf_counter()
+    outputs = keyframe_detector(frames)
+    elapsed = time.perf_counter() - start
+    for detections, (boxes, class_ids) in zip(outputs, truth):
+        matched_truth, matched_predictions = score(detections, boxes, class_ids)
+        found += matched_truth
+        predicted_good += matched_predictions
+        expected += len(boxes)
+        predicted += len(detections.boxes)
+
+    counts = keyframe_detector.counts()
+    names = GroundTruthDetector.names
+    count_error = sum(abs(counts[names[cls]] - n) for cls, n in unique.items())
+    count_error += sum(counts[name] for cls, name in names.items() if cls not in unique)
+    return {
+        "fps": len(frames) / elapsed,
+        "keyframes": keyframe_detector.keyframes,
+        "recall": found / max(expected, 1),
+        "precision": predicted_good / max(predicted, 1),
+        "count_error": count_error,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accuracy versus FPS of keyframe detection with tracking.")
+    parser.add_argument("-n", "--frames", type=int, default=300)
+    parser.add_argument("--size", type=int, nargs=2, default=(720, 1280), metavar=("HEIGHT", "WIDTH"))
+    parser.add_argument("--vehicles", type=int, default=12)
+    parser.add_argument("--delay", type=float, default=0.03, help="simulated detection seconds per frame")
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1, 2, 5, 10, 20])
+    parser.add_argument("--propagation", nargs="+", choices=PROPAGATION_MODES, default=list(PROPAGATION_MODES))
+    parser.add_argument("--motion-threshold", type=float, default=4.0,
+                        help="also run a long-interval configuration with this motion trigger")
+    parser.add_argument("--min-hits", type=int, default=MIN_HITS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    height, width = args.size
+    frames, truth, unique = moving_vehicles(args.frames, height, width, args.vehicles, args.seed)
+    print(f"{sum(unique.values())} vehicles, {sum(len(b) for b, _ in truth)} ground truth boxes")
+
+    configs = [("every frame", {"interval": 1, "propagation": "hold"})]
+    for interval in args.intervals:
+        if interval == 1:
+            continue
+        for propagation in args.propagation:
+            configs.append((f"every {interval} {propagation}", {"interval": interval, "propagation": propagation}))
+    if args.motion_threshold:
+        configs.append((f"motion > {args.motion_threshold:g} flow",
+                        {"interval": max(args.intervals) * 2, "motion_threshold": args.motion_threshold}))
+
+    print(f"{'config':<22}{'fps':>9}{'keyframes':>11}{'recall':>9}{'precision':>11}{'count err':>11}")
+    for name, options in configs:
+        r = run_config(frames, truth, unique, args.delay, min_hits=args.min_hits, **options)
+        print(f"{name:<22}{r['fps']:>9.1f}{r['keyframes']:>11}{r['recall']:>9.3f}"
+              f"{r['precision']:>11.3f}{r['count_error']:>11}")
+
+
+if __name__ == "__main__":
+    main()
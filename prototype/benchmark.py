@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from backends import load_detector
+from detection import CONF_THRESHOLD, StubDetector
+from enhancement import apply_enhancement, default_enhancer
+from frames import cv2_to_pil, pil_to_cv2
+from metrics import CII_RELATIVE_TOLERANCE, ENTROPY_TOLERANCE, Metrics, MetricsEngine
+from synthetic import CONDITIONS, synthetic_frame
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+RESOLUTIONS = {
+    "720p": (720, 1280),
+    "1080p": (1080, 1920),
+    "4K": (2160, 3840),
+}
+
+# Default relative slowdown of a case's p50 before compare calls it a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+def max_rss_mb():
+    # Peak resident memory of this process, None where it cannot be read
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes elsewhere
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, "peak_wset", memory.rss) / 2 ** 20
+
+
+def build_cases(image, detector):
+    # name -> callable for one input frame; setup happens here, not in the timing
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    enhanced = apply_enhancement(image)
+    gray_enhanced = cv2.cvtColor(enhanced, cv2.COLOR_BGR2GRAY)
+    pil_image = cv2_to_pil(image)
+    metrics = Metrics()
+    engine = MetricsEngine()
+    out = np.empty_like(image)
+    luma_out = np.empty(image.shape[:2], dtype=np.uint8)
+
+    cases = {
+        "apply_enhancement": lambda: apply_enhancement(image),
+        "Enhancer.enhance_fused": lambda: default_enhancer.enhance_fused(image, out=out, luma_out=luma_out),
+        "Metrics.calculate_entropy": lambda: metrics.calculate_entropy(gray),
+        "Metrics.calculate_cii": lambda: metrics.calculate_cii(gray, gray_enhanced),
+        "MetricsEngine.evaluate": lambda: engine.evaluate(gray, gray_enhanced),
+        "pil_to_cv2": lambda: pil_to_cv2(pil_image),
+        "cv2_to_pil": lambda: cv2_to_pil(image),
+    }
+    if detector is not None:
+        cases["detect"] = lambda: detector([enhanced])
+    return cases
+
+
+def time_case(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    latencies = np.empty(iterations, dtype=np.float64)
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies[i] = time.perf_counter() - start
+
+    # A separate traced run so tracemalloc does not distort the timings;
+    # it sees numpy and OpenCV buffers
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99])
+    return {
+        "iterations": iterations,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "mean_ms": float(latencies.mean() * 1000),
+        "throughput_per_s": float(iterations / latencies.sum()),
+        "peak_mb": peak / 2 ** 20,
+    }
+
+
+def run(args):
+    if args.weights:
+        detector = load_detector(args.weights, conf=args.conf)
+        detector_name = args.weights
+    elif args.no_detect:
+        detector, detector_name = None, None
+    else:
+        detector = StubDetector(frame_delay=args.stub_delay, conf=args.conf)
+        detector_name = "stub"
+
+    results = []
+    for resolution in args.resolutions:
+        height, width = RESOLUTIONS[resolution]
+        for condition in args.conditions:
+            image = synthetic_frame(height, width, condition, seed=args.seed)
+            for name, fn in build_cases(image, detector).items():
+                if args.filter and args.filter not in name:
+                    continue
+                result = time_case(fn, args.iterations, args.warmup)
+                result["name"] = f"{name}/{resolution}/{condition}"
+                results.append(result)
+                print(f"{result['name']:<45} p50 {result['p50_ms']:9.3f} ms  p99 {result['p99_ms']:9.3f} ms  "
+                      f"{result['throughput_per_s']:9.1f}/s  peak {result['peak_mb']:7.1f} MB", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "detector": detector_name,
+            "iterations": args.iterations,
+            "max_rss_mb": max_rss_mb(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+def parity(args):
+    # MetricsEngine against the original Metrics on the benchmark frames,
+    # within ENTROPY_TOLERANCE and CII_RELATIVE_TOLERANCE
+    metrics = Metrics()
+    engine = MetricsEngine()
+    failures = 0
+    for resolution in args.resolutions:
+        height, width = RESOLUTIONS[resolution]
+        for condition in args.conditions:
+            image = synthetic_frame(height, width, condition, seed=args.seed)
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            gray_enhanced = cv2.cvtColor(apply_enhancement(image), cv2.COLOR_BGR2GRAY)
+            result = engine.evaluate(gray, gray_enhanced)
+            entropy_diff = max(abs(result.entropy_original - metrics.calculate_entropy(gray)),
+                               abs(result.entropy_enhanced - metrics.calculate_entropy(gray_enhanced)))
+            expected_cii = metrics.calculate_cii(gray, gray_enhanced)
+            cii_diff = abs(result.cii - expected_cii) / abs(expected_cii)
+            ok = entropy_diff <= ENTROPY_TOLERANCE and cii_diff <= CII_RELATIVE_TOLERANCE
+            failures += not ok
+            print(f"{resolution + '/' + condition:<20} entropy diff {entropy_diff:.2e}  "
+                  f"cii relative diff {cii_diff:.2e}{'' if ok else '  FAIL'}")
+
+    if failures:
+        print(f"{failures} frame(s) outside entropy {ENTROPY_TOLERANCE:g} / cii {CII_RELATIVE_TOLERANCE:g}")
+        return 1
+    print("MetricsEngine matches Metrics")
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    with open(args.candidate) as f:
+        candidate = {r["name"]: r for r in json.load(f)["results"]}
+
+    regressions = []
+    print(f"{'case':<45}{'base ' + args.metric:>16}{'new':>12}{'change':>10}")
+    for name in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[name][args.metric], candidate[name][args.metric]
+        # Higher is better for throughput, lower for everything else
+        if args.metric == "throughput_per_s":
+            change = old / new - 1 if new else float("inf")
+        else:
+            change = new / old - 1 if old else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<45}{old:>16.3f}{new:>12.3f}{change:>+9.1%}{flag}")
+    for name in sorted(baseline.keys() - candidate.keys()):
+        print(f"{name:<45} missing from {args.candidate}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+        return 1
+    print("No regressions")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark enhancement, metrics, conversions and detection.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and write JSON results")
+    run_parser.add_argument("-o", "--output", help="write results here instead of stdout")
+    run_parser.add_argument("--resolutions", nargs="+", choices=RESOLUTIONS, default=list(RESOLUTIONS))
+    run_parser.add_argument("--conditions", nargs="+", choices=CONDITIONS, default=list(CONDITIONS))
+    run_parser.add_argument("-n", "--iterations", type=int, default=20)
+    run_parser.add_argument("--warmup", type=int, default=2)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("-k", "--filter", help="only run cases whose name contains this")
+    run_parser.add_argument("--weights", help="benchmark this YOLO model (.pt or .onnx) instead of the stub detector")
+    run_parser.add_argument("--stub-delay", type=float, default=0.0, help="simulated seconds per stub detection")
+    run_parser.add_argument("--no-detect", action="store_true")
+    run_parser.add_argument("--conf", type=float, default=CONF_THRESHOLD)
+    run_parser.set_defaults(func=run)
+
+    parity_parser = commands.add_parser("parity", help="check MetricsEngine against Metrics within the "
+                                        "tolerances in metrics.py")
+    parity_parser.add_argument("--resolutions", nargs="+", choices=RESOLUTIONS, default=list(RESOLUTIONS))
+    parity_parser.add_argument("--conditions", nargs="+", choices=CONDITIONS, default=list(CONDITIONS))
+    parity_parser.add_argument("--seed", type=int, default=0)
+    parity_parser.set_defaults(func=parity)
+
+    compare_parser = commands.add_parser("compare", help="flag regressions between two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--metric", default="p50_ms",
+                                choices=("p50_ms", "p95_ms", "p99_ms", "mean_ms", "throughput_per_s", "peak_mb"))
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
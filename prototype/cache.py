@@ -0,0 +1,222 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from detection import Detections
+from metrics import PairMetrics
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "prototype")
+DISK_MAX_BYTES = 2 * 1024 ** 3
+MEMORY_MAX_BYTES = 256 * 1024 ** 2
+
+# Bumped whenever the meaning of cached values changes
+CACHE_VERSION = 1
+
+_file_hashes = {}
+
+
+def file_hash(path):
+    # Hash of a file's bytes, remembered per (path, size, mtime)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return str(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _file_hashes.get(key)
+    if digest is None:
+        hasher = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(chunk)
+        digest = _file_hashes[key] = hasher.hexdigest()
+    return digest
+
+
+def cache_key(kind, image_hash, **params):
+    payload = json.dumps({"v": CACHE_VERSION, "kind": kind, "image": image_hash, **params},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def enhancement_params(enhancer):
+    # None when the output is not a function of the parameters (random gamma)
+    if not enhancer.deterministic:
+        return None
+    return {
+        "gamma_mode": enhancer.gamma_mode,
+        "gamma": enhancer.gamma if enhancer.gamma_mode == "fixed" else None,
+        "seed": enhancer.seed if enhancer.gamma_mode == "content" else None,
+        "clip_limit": enhancer.clip_limit,
+        "tile_grid_size": list(enhancer.tile_grid_size),
+    }
+
+
+def detection_params(weights, conf):
+    return {"weights": file_hash(weights), "conf": conf}
+
+
+def detections_to_arrays(detections):
+    return {
+        "boxes": detections.boxes,
+        "confidences": detections.confidences,
+        "class_ids": detections.class_ids,
+        "names": np.array(json.dumps({str(k): v for k, v in detections.names.items()})),
+    }
+
+
+def arrays_to_detections(arrays):
+    names = {int(k): v for k, v in json.loads(str(arrays["names"])).items()}
+    return Detections(arrays["boxes"], arrays["confidences"], arrays["class_ids"], names)
+
+
+def metrics_to_arrays(metrics):
+    return metrics._asdict()
+
+
+def arrays_to_metrics(arrays):
+    values = {name: arrays[name] for name in PairMetrics._fields}
+    for name, value in values.items():
+        if not name.startswith("hist") and value.ndim == 0:
+            values[name] = float(value)
+    return PairMetrics(**values)
+
+
+class ResultCache:
+    # Arrays keyed by content hash and pipeline parameters, kept in a small
+    # in-memory LRU in front of a directory of .npz files. Files are written
+    # to a temporary name and renamed into place, so several processes can
+    # share one directory: readers see a whole file or none, and writers of
+    # the same key write the same content. When the directory grows past
+    # disk_max_bytes the least recently used files are removed.
+    def __init__(self, directory=CACHE_DIR, disk_max_bytes=DISK_MAX_BYTES, memory_max_bytes=MEMORY_MAX_BYTES):
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._written_since_scan = None
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".npz")
+
+    def get(self, key):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = self._read(key) if self.directory else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(key, value)
+        return value
+
+    def put(self, key, arrays):
+        arrays = {name: np.asarray(value) for name, value in arrays.items()}
+        self._remember(key, arrays)
+        if self.directory:
+            try:
+                self._write(key, arrays)
+            except OSError:
+                # A full or read-only disk only costs us the disk copy
+                pass
+        return arrays
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def _remember(self, key, arrays):
+        size = sum(value.nbytes for value in arrays.values())
+        if size > self.memory_max_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = arrays
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_max_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= sum(value.nbytes for value in evicted.values())
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+            # The modification time doubles as the last-used time for eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    def _write(self, key, arrays):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(buffer.getbuffer())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        # Rescan the directory on the first write and then after roughly a
+        # tenth of the budget has been written by this process
+        with self._lock:
+            if self._written_since_scan is not None:
+                self._written_since_scan += buffer.tell()
+                if self._written_since_scan < self.disk_max_bytes // 10:
+                    return
+            self._written_since_scan = 0
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".npz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process evicted it first
+                pass
+            total -= size
+        return total
@@ -0,0 +1,199 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+CONF_THRESHOLD = 0.25
+# Inference size the model was trained at
+IMGSZ = 640
+VEHICLE_CLASSES = ('bus', 'car', 'motor', 'truck')
+
+
+class Detections(NamedTuple):
+    boxes: np.ndarray        # N x 4 float32, x1 y1 x2 y2 in pixels
+    confidences: np.ndarray  # N float32
+    class_ids: np.ndarray    # N int64
+    names: dict              # class id -> lower case class name
+
+
+def empty_detections(names):
+    return Detections(
+        np.zeros((0, 4), dtype=np.float32),
+        np.zeros(0, dtype=np.float32),
+        np.zeros(0, dtype=np.int64),
+        names,
+    )
+
+
+def from_result(result):
+    # Moves all boxes of one ultralytics result to numpy at once
+    names = {int(k): str(v).lower() for k, v in result.names.items()}
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return empty_detections(names)
+    return Detections(
+        boxes.xyxy.cpu().numpy().astype(np.float32),
+        boxes.conf.cpu().numpy().astype(np.float32),
+        boxes.cls.cpu().numpy().astype(np.int64),
+        names,
+    )
+
+
+def count_objects(detections, classes=VEHICLE_CLASSES):
+    # Per-class counts from one bincount over the class ids
+    counts = {name: 0 for name in classes}
+    if len(detections.class_ids) == 0:
+        return counts
+    per_id = np.bincount(detections.class_ids)
+    for cls in np.flatnonzero(per_id):
+        name = detections.names.get(int(cls))
+        if name in counts:
+            counts[name] += int(per_id[cls])
+    return counts
+
+
+def draw_detections(image, detections):
+    # Draws onto `image` in place, same style as the object detection page
+    for (x1, y1, x2, y2), conf, cls in zip(detections.boxes.astype(int), detections.confidences, detections.class_ids):
+        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+        class_name = detections.names.get(int(cls), str(cls))
+
+        cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+
+        label = f"{class_name}: {conf:.2f}"
+        (text_width, text_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        cv2.rectangle(image, (x1, y1 - text_height - 10), (x1 + text_width, y1), (0, 255, 0), -1)
+        cv2.putText(image, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+    return image
+
+
+class YoloDetector:
+    # imgsz=None keeps the model's own inference size
+    dynamic_imgsz = True
+
+    def __init__(self, model, conf=CONF_THRESHOLD, imgsz=None):
+        self.model = model
+        self.conf = conf
+        self.imgsz = imgsz
+
+    def __call__(self, frames):
+        options = {"imgsz": self.imgsz} if self.imgsz else {}
+        results = self.model(list(frames), conf=self.conf, verbose=False, **options)
+        return [from_result(result) for result in results]
+
+
+class StubDetector:
+    # Stands in for YOLO in tests and benchmarks: returns a few fixed boxes
+    # per frame after sleeping for a simulated inference time.
+    names = {0: 'bus', 1: 'car', 2: 'motor', 3: 'truck'}
+    dynamic_imgsz = True
+
+    def __init__(self, call_delay=0.0, frame_delay=0.0, boxes_per_frame=4, conf=CONF_THRESHOLD, imgsz=None):
+        self.call_delay = call_delay
+        self.frame_delay = frame_delay
+        self.boxes_per_frame = boxes_per_frame
+        self.conf = conf
+        self.imgsz = imgsz
+
+    def detect_one(self, frame):
+        height, width = frame.shape[:2]
+        n = self.boxes_per_frame
+        i = np.arange(n, dtype=np.float32)
+        x1 = (i + 0.1) * width / max(n, 1)
+        y1 = np.full(n, height * 0.4, dtype=np.float32)
+        boxes = np.stack([x1, y1, x1 + width / max(n, 1) * 0.8, y1 + height * 0.2], axis=1)
+        confidences = np.linspace(0.9, 0.3, n, dtype=np.float32)
+        class_ids = np.arange(n, dtype=np.int64) % len(self.names)
+        keep = confidences >= self.conf
+        return Detections(boxes[keep].astype(np.float32), confidences[keep], class_ids[keep], self.names)
+
+    def __call__(self, frames):
+        frames = list(frames)
+        frame_delay = self.frame_delay
+        if self.imgsz:
+            # Inference cost grows with the number of input pixels
+            frame_delay *= (self.imgsz / IMGSZ) ** 2
+        delay = self.call_delay + frame_delay * len(frames)
+        if delay:
+            time.sleep(delay)
+        return [self.detect_one(frame) for frame in frames]
+
+
+class BatchDetectionService:
+    # Collects frames submitted from any thread into micro-batches and runs
+    # the detector once per batch. A batch is sent when it reaches
+    # max_batch_size or when its oldest frame has waited max_wait seconds.
+    def __init__(self, detector, max_batch_size=8, max_wait=0.01):
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.frames = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="detection-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        if self._closed:
+            raise RuntimeError("BatchDetectionService is closed")
+        future = Future()
+        self._queue.put((frame, future))
+        return future
+
+    def detect(self, frame):
+        return self.submit(frame).result()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            batch = [(frame, future) for frame, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.detector([frame for frame, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.frames += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
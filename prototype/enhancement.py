@@ -1,33 +1,262 @@
+import copy
 import cv2
+import hashlib
 import numpy as np
 import random
+import threading
+from functools import lru_cache
+
+from tracing import span
 
 CLIP_LIMIT = 2.0
 TILE_GRID_SIZE = (16, 32)
 
+# Gamma values are rounded to this step before looking up a table, so the
+# cache stays bounded while any gamma maps to exactly one table.
+GAMMA_STEP = 0.001
+GAMMA_CACHE_SIZE = 1024
+
+GAMMA_RANGE = (0.5, 1.0)
+STATIC_PIXEL_DELTA = 12
+GAMMA_MODES = ("random", "fixed", "content", "adaptive")
+
+
+def quantize_gamma(gamma):
+    return round(round(gamma / GAMMA_STEP) * GAMMA_STEP, 6)
+
+
+def content_hash(image, seed=0):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.shape}{image.dtype}{seed}".encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=GAMMA_CACHE_SIZE)
+def gamma_table(gamma):
+    table = ((np.arange(0, 256) / 255.0) ** gamma) * 255
+    table = table.astype("uint8")
+    table.setflags(write=False)
+    return table
+
+
+class Enhancer:
+    # gamma_mode selects how gamma is picked for each image:
+    #   random   - random.uniform(0.5, 1.0) from the global generator (original behaviour)
+    #   fixed    - always `gamma`
+    #   content  - derived from a hash of the pixels and `seed`, same image gives same gamma
+    #   adaptive - from the mean brightness, darker images get a stronger correction
+    def __init__(self, clip_limit=CLIP_LIMIT, tile_grid_size=TILE_GRID_SIZE,
+                 gamma_mode="random", gamma=0.75, seed=0):
+        if gamma_mode not in GAMMA_MODES:
+            raise ValueError(f"Unknown gamma mode {gamma_mode!r}, expected one of {GAMMA_MODES}")
+        self.clip_limit = clip_limit
+        self.tile_grid_size = tuple(tile_grid_size)
+        self.gamma_mode = gamma_mode
+        self.gamma = gamma
+        self.seed = seed
+        # CLAHE objects are not safe to share between threads
+        self._local = threading.local()
+
+    @property
+    def clahe(self):
+        clahe = getattr(self._local, "clahe", None)
+        if clahe is None:
+            clahe = cv2.createCLAHE(clipLimit=self.clip_limit, tileGridSize=self.tile_grid_size)
+            self._local.clahe = clahe
+        return clahe
+
+    @property
+    def deterministic(self):
+        return self.gamma_mode != "random"
+
+    def choose_gamma(self, image):
+        low, high = GAMMA_RANGE
+        if self.gamma_mode == "fixed":
+            return self.gamma
+        if self.gamma_mode == "content":
+            # Map the first 8 bytes of the hash onto the gamma range without
+            # touching any shared random generator.
+            fraction = int(content_hash(image, self.seed)[:16], 16) / 2 ** 64
+            return quantize_gamma(low + (high - low) * fraction)
+        if self.gamma_mode == "adaptive":
+            # Pick the gamma that maps the mean brightness to mid-grey
+            small = image[::4, ::4]
+            mean = float(np.mean(small)) / 255.0
+            if mean <= 0.0:
+                return low
+            if mean >= 1.0:
+                return high
+            return quantize_gamma(min(max(np.log(0.5) / np.log(mean), low), high))
+        return random.uniform(low, high)
+
+    def gamma_table(self, gamma):
+        return gamma_table(quantize_gamma(gamma))
+
+    def enhance(self, image, gamma=None):
+        if image is None:
+            return None
+
+        # Gamma Correction
+        with span("enhance.gamma_lut"):
+            if gamma is None:
+                gamma = self.choose_gamma(image)
+            gamma_corrected_image = cv2.LUT(image, self.gamma_table(gamma))
+
+        #BGR to YCrCb Conversion
+
+        with span("enhance.to_ycrcb"):
+            ycrcb_image = cv2.cvtColor(gamma_corrected_image, cv2.COLOR_BGR2YCrCb)
+
+        # Apply CLAHE on the Luminance (Y) channel
+
+        with span("enhance.clahe"):
+            y, cr, cb = cv2.split(ycrcb_image)
+            clahe_y = self.clahe.apply(y)
+            clahe_ycrcb = cv2.merge([clahe_y, cr, cb])
+
+        # Convert back to BGR
+        with span("enhance.to_bgr"):
+            final_image = cv2.cvtColor(clahe_ycrcb, cv2.COLOR_YCrCb2BGR)
+
+        return final_image
+
+    __call__ = enhance
+
+    def replace(self, **changes):
+        # A copy with some parameters changed, with its own CLAHE objects and buffers
+        enhancer = copy.copy(self)
+        for name, value in changes.items():
+            setattr(enhancer, name, tuple(value) if name == "tile_grid_size" else value)
+        enhancer._local = threading.local()
+        return enhancer
+
+    def _scratch(self, shape):
+        # Intermediate buffers kept per thread and reused while the frame size stays the same
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None or buffers[0].shape != shape:
+            buffers = (np.empty(shape, np.uint8), np.empty(shape, np.uint8), np.empty(shape[:2], np.uint8))
+            self._local.buffers = buffers
+        return buffers
+
+    def enhance_fused(self, image, gamma=None, out=None, luma_out=None, luma_gamma=False):
+        # Same pixels as enhance() for a BGR image, without the split/merge
+        # copies: every step writes into a reused buffer and only the luma
+        # plane is taken out and put back. Also returns that enhanced luma,
+        # which equals cv2.cvtColor(out, cv2.COLOR_BGR2GRAY) up to rounding,
+        # so metrics need no second conversion. Pass `out` / `luma_out` to
+        # fill existing arrays. luma_gamma=True applies gamma to Y only,
+        # one plane instead of three; colours come out less saturated than
+        # with enhance() (see golden_enhancement.py for the difference).
+        if image is None:
+            return None, None
+        corrected, ycrcb, y = self._scratch(image.shape)
+        if out is None:
+            out = np.empty_like(image)
+        if luma_out is None:
+            luma_out = np.empty(image.shape[:2], dtype=np.uint8)
+        if gamma is None:
+            gamma = self.choose_gamma(image)
+        table = self.gamma_table(gamma)
+
+        if luma_gamma:
+            with span("enhance.to_ycrcb"):
+                cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb, dst=ycrcb)
+                cv2.extractChannel(ycrcb, 0, dst=y)
+            with span("enhance.gamma_lut"):
+                cv2.LUT(y, table, dst=y)
+        else:
+            with span("enhance.gamma_lut"):
+                cv2.LUT(image, table, dst=corrected)
+            with span("enhance.to_ycrcb"):
+                cv2.cvtColor(corrected, cv2.COLOR_BGR2YCrCb, dst=ycrcb)
+                cv2.extractChannel(ycrcb, 0, dst=y)
+
+        with span("enhance.clahe"):
+            self.clahe.apply(y, dst=luma_out)
+            cv2.insertChannel(luma_out, ycrcb, 0)
+
+        with span("enhance.to_bgr"):
+            cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR, dst=out)
+        return out, luma_out
+
+
+default_enhancer = Enhancer()
+
+
 def apply_enhancement(image):
+    return default_enhancer.enhance(image)
+
+
+class VideoEnhancer(Enhancer):
+    # Stateful enhancer for consecutive frames of one camera. Gamma follows
+    # the per-frame choice through an exponential moving average, so it does
+    # not flicker, and snaps to the new value on a scene change (a jump in a
+    # small luma histogram from the previous frame). When a frame barely
+    # differs from the one the last output was computed from, that output is
+    # reused instead of running gamma, colour conversion and CLAHE again.
+    def __init__(self, clip_limit=CLIP_LIMIT, tile_grid_size=TILE_GRID_SIZE,
+                 gamma_mode="adaptive", gamma=0.75, seed=0, smoothing=0.1,
+                 scene_change_threshold=0.3, static_fraction=0.001, probe_size=(160, 90)):
+        super().__init__(clip_limit, tile_grid_size, gamma_mode, gamma, seed)
+        self.smoothing = smoothing
+        # L1 distance between normalized 32-bin histograms, 0 (same) to 2
+        self.scene_change_threshold = scene_change_threshold
+        # Share of probe pixels whose luma may move by more than
+        # STATIC_PIXEL_DELTA (sensor noise) for a frame to count as static;
+        # kept low so a single moving vehicle forces a fresh output
+        self.static_fraction = static_fraction
+        self.probe_size = probe_size
+        self.reset()
 
-    if image is None:
-        return None 
+    def replace(self, **changes):
+        enhancer = super().replace(**changes)
+        enhancer.reset()
+        return enhancer
 
-    # Random Gamma Correction
-    random_gamma = random.uniform(0.5, 1.0)
-    gamma_table = np.array([((i / 255.0) ** random_gamma) * 255 
-                            for i in np.arange(0, 256)]).astype("uint8")
-    gamma_corrected_image = cv2.LUT(image, gamma_table)
+    def reset(self):
+        self.frames = 0
+        self.reused = 0
+        self.scene_changes = 0
+        self._gamma = None
+        self._probe = None
+        self._hist = None
+        self._output = None
 
-    #BGR to YCrCb Conversion
+    def _probe_frame(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        probe = cv2.resize(gray, self.probe_size, interpolation=cv2.INTER_AREA)
+        hist = cv2.calcHist([probe], [0], None, [32], [0, 256]).ravel()
+        return probe, hist / max(hist.sum(), 1.0)
 
-    ycrcb_image = cv2.cvtColor(gamma_corrected_image, cv2.COLOR_BGR2YCrCb)
+    def enhance(self, image, gamma=None):
+        if image is None:
+            return None
+        self.frames += 1
 
-    # Apply CLAHE on the Luminance (Y) channel
+        with span("video.probe"):
+            probe, hist = self._probe_frame(image)
+            same_shape = self._output is not None and self._output.shape == image.shape
+            scene_change = not same_shape or np.abs(hist - self._hist).sum() > self.scene_change_threshold
 
-    y, cr, cb = cv2.split(ycrcb_image)
-    clahe = cv2.createCLAHE(clipLimit=CLIP_LIMIT, tileGridSize=TILE_GRID_SIZE)
-    clahe_y = clahe.apply(y)
-    clahe_ycrcb = cv2.merge([clahe_y, cr, cb])
+        if not scene_change:
+            changed = np.count_nonzero(cv2.absdiff(probe, self._probe) > STATIC_PIXEL_DELTA)
+            if changed <= self.static_fraction * probe.size:
+                # Callers may draw on the frame they get, keep ours clean
+                self.reused += 1
+                self._hist = hist
+                return self._output.copy()
 
-    # Convert back to BGR
-    final_image = cv2.cvtColor(clahe_ycrcb, cv2.COLOR_YCrCb2BGR)
+        if gamma is None:
+            target = self.choose_gamma(image)
+            if scene_change or self._gamma is None:
+                self._gamma = target
+            else:
+                self._gamma += self.smoothing * (target - self._gamma)
+            gamma = self._gamma
+        if scene_change:
+            self.scene_changes += 1
 
-    return final_image
\ No newline at end of file
+        output = super().enhance(image, gamma=gamma)
+        self._probe, self._hist, self._output = probe, hist, output
+        return output.copy()
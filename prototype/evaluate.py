@@ -0,0 +1,433 @@
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from batch import collect_inputs
+from detection import VEHICLE_CLASSES, StubDetector
+from enhancement import GAMMA_MODES, Enhancer
+from framestore import FrameStore, is_store
+from metrics import MetricsEngine
+from tracing import enable_from_args, span, tracer
+from tracking import iou_matrix
+
+VARIANTS = ("raw", "enhanced")
+# mAP@0.5 and COCO style mAP@0.5:0.95
+IOU_THRESHOLDS = np.round(np.arange(0.5, 0.96, 0.05), 2)
+# Low enough that the precision-recall curve reaches high recall
+EVAL_CONF = 0.001
+# Precision and recall are reported for detections at or above this
+REPORT_CONF = 0.25
+
+# Detections are accumulated as true/false positive counts per confidence
+# bin instead of a list of every detection, so memory does not grow with
+# the dataset. 1000 bins put AP within about 0.001 of the exact value.
+CONF_BINS = 1000
+ENTROPY_BINS = np.linspace(0.0, 8.0, 161)
+CII_BINS = np.linspace(0.0, 5.0, 201)
+
+
+def label_path(image_path):
+    # YOLO layout: .../images/x.jpg -> .../labels/x.txt, else x.txt next to the image
+    root, _ = os.path.splitext(image_path)
+    parts = root.split(os.sep)
+    if "images" in parts:
+        index = len(parts) - 1 - parts[::-1].index("images")
+        parts[index] = "labels"
+        candidate = os.sep.join(parts) + ".txt"
+        if os.path.exists(candidate):
+            return candidate
+    return root + ".txt"
+
+
+def load_labels(path, width, height):
+    # "class cx cy w h" per line, normalized to the image size -> x1 y1 x2 y2 pixels
+    try:
+        rows = np.loadtxt(path, ndmin=2, dtype=np.float32)
+    except (OSError, ValueError):
+        rows = np.zeros((0, 5), dtype=np.float32)
+    if rows.size == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int64)
+    centre = rows[:, 1:3] * (width, height)
+    size = rows[:, 3:5] * (width, height)
+    boxes = np.concatenate([centre - size / 2, centre + size / 2], axis=1)
+    return boxes.astype(np.float32), rows[:, 0].astype(np.int64)
+
+
+def match(boxes, confidences, class_ids, gt_boxes, gt_class_ids, n_classes):
+    # Greedy matching per class, highest confidence first, at every IoU
+    # threshold. Returns (thresholds, detections) true positive flags and
+    # the confidence bin of each detection.
+    tp = np.zeros((len(IOU_THRESHOLDS), len(boxes)), dtype=bool)
+    for cls in range(n_classes):
+        det = np.flatnonzero(class_ids == cls)
+        gt = np.flatnonzero(gt_class_ids == cls)
+        if det.size == 0 or gt.size == 0:
+            continue
+        det = det[np.argsort(-confidences[det], kind="stable")]
+        iou = iou_matrix(boxes[det], gt_boxes[gt])
+        for t, threshold in enumerate(IOU_THRESHOLDS):
+            taken = np.zeros(gt.size, dtype=bool)
+            for row, d in enumerate(det):
+                candidates = np.where(taken, -1.0, iou[row])
+                best = int(candidates.argmax())
+                if candidates[best] >= threshold:
+                    taken[best] = True
+                    tp[t, d] = True
+    bins = np.minimum((confidences * CONF_BINS).astype(np.int64), CONF_BINS - 1)
+    return tp, bins
+
+
+class DetectionAccumulator:
+    # Streaming per-class AP/precision/recall from binned confidences
+    def __init__(self, n_classes):
+        self.n_classes = n_classes
+        self.tp = np.zeros((len(IOU_THRESHOLDS), n_classes, CONF_BINS), dtype=np.int64)
+        self.fp = np.zeros_like(self.tp)
+        self.n_gt = np.zeros(n_classes, dtype=np.int64)
+
+    def add(self, tp, bins, class_ids, gt_class_ids):
+        self.n_gt += np.bincount(gt_class_ids, minlength=self.n_classes)[:self.n_classes]
+        valid = class_ids < self.n_classes
+        for t in range(len(IOU_THRESHOLDS)):
+            np.add.at(self.tp[t], (class_ids[valid], bins[valid]), tp[t, valid])
+            np.add.at(self.fp[t], (class_ids[valid], bins[valid]), ~tp[t, valid])
+
+    def merge(self, other):
+        self.tp += other.tp
+        self.fp += other.fp
+        self.n_gt += other.n_gt
+
+    def summary(self, report_conf=REPORT_CONF):
+        # Cumulative counts from the highest confidence bin down give the
+        # precision-recall curve; AP uses COCO's 101 point interpolation
+        tp = self.tp[:, :, ::-1].cumsum(axis=2)
+        fp = self.fp[:, :, ::-1].cumsum(axis=2)
+        n_gt = np.maximum(self.n_gt, 1)[None, :, None]
+        recall = tp / n_gt
+        precision = tp / np.maximum(tp + fp, 1)
+        # Precision envelope: best precision at any higher recall
+        precision = np.maximum.accumulate(precision[:, :, ::-1], axis=2)[:, :, ::-1]
+        points = np.linspace(0, 1, 101)
+        ap = np.zeros((len(IOU_THRESHOLDS), self.n_classes))
+        for t in range(len(IOU_THRESHOLDS)):
+            for c in range(self.n_classes):
+                index = np.searchsorted(recall[t, c], points, side="left")
+                inside = index < CONF_BINS
+                ap[t, c] = np.where(inside, precision[t, c, np.minimum(index, CONF_BINS - 1)], 0).mean()
+
+        # Bins at or above report_conf, counted from the top
+        cut = CONF_BINS - int(report_conf * CONF_BINS) - 1
+        tp50, fp50 = tp[0, :, cut], fp[0, :, cut]
+        return {
+            "ap50": ap[0],
+            "ap50_95": ap.mean(axis=0),
+            "precision": tp50 / np.maximum(tp50 + fp50, 1),
+            "recall": tp50 / np.maximum(self.n_gt, 1),
+            "n_gt": self.n_gt,
+            "n_detections": tp50 + fp50,
+        }
+
+
+class Distribution:
+    # Histogram plus running moments of one per-image value. Non-finite
+    # values (the CII of a flat frame is inf) are only counted, so they do
+    # not turn the moments into inf or NaN.
+    def __init__(self, edges):
+        self.edges = edges
+        self.counts = np.zeros(len(edges) - 1, dtype=np.int64)
+        self.n = 0
+        self.non_finite = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, value):
+        if not math.isfinite(value):
+            self.non_finite += 1
+            return
+        index = np.clip(np.searchsorted(self.edges, value, side="right") - 1, 0, len(self.counts) - 1)
+        self.counts[index] += 1
+        self.n += 1
+        self.total += value
+        self.total_sq += value * value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        if self.n == 0:
+            return 0.0
+        cumulative = np.cumsum(self.counts)
+        index = int(np.searchsorted(cumulative, q / 100 * self.n))
+        return float((self.edges[index] + self.edges[index + 1]) / 2)
+
+    def summary(self):
+        if self.n == 0:
+            return {"count": 0, "non_finite": self.non_finite}
+        mean = self.total / self.n
+        return {
+            "count": self.n,
+            "non_finite": self.non_finite,
+            "mean": mean,
+            "std": max(self.total_sq / self.n - mean * mean, 0.0) ** 0.5,
+            "min": self.min,
+            "max": self.max,
+            "p5": self.percentile(5),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "histogram": {"edges": self.edges.tolist(), "counts": self.counts.tolist()},
+        }
+
+
+_enhancer = None
+_detector = None
+_engine = None
+_class_map = None
+_store = None
+
+
+def init_worker(names, weights, stub_detector, conf, gamma_mode, gamma, seed, trace=False, store_path=None):
+    global _enhancer, _detector, _engine, _class_map, _store
+    cv2.setNumThreads(1)
+    if trace:
+        tracer.enable(histograms=False)
+    _enhancer = Enhancer(gamma_mode=gamma_mode, gamma=gamma, seed=seed)
+    _engine = MetricsEngine()
+    if stub_detector:
+        _detector = StubDetector(conf=conf)
+    else:
+        from backends import load_detector
+        _detector = load_detector(weights, conf=conf)
+    _class_map = {name: index for index, name in enumerate(names)}
+    # Every worker maps the same store; frames are read without decoding
+    _store = FrameStore(store_path) if store_path else None
+
+
+def to_dataset_classes(detections):
+    # Detector class ids -> dataset class ids by name; other classes are dropped
+    mapping = np.array([_class_map.get(detections.names.get(i), -1)
+                        for i in range(int(detections.class_ids.max(initial=-1)) + 1)], dtype=np.int64)
+    class_ids = mapping[detections.class_ids] if len(detections.class_ids) else detections.class_ids
+    keep = class_ids >= 0
+    return detections.boxes[keep], detections.confidences[keep], class_ids[keep]
+
+
+def evaluate_file(item):
+    # Runs in a worker; returns only small per-image results. `item` is an
+    # image path, or a frame index when reading from a frame store.
+    enhanced = None
+    if _store is not None:
+        image = _store[item]
+        enhanced = _store.enhanced(item)
+        path = _store.source(item) or _store.name(item)
+    else:
+        path = item
+        with span("evaluate.decode"):
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Could not decode {path}")
+    height, width = image.shape[:2]
+    # Labels are normalized, so they fit a downscaled stored frame as well
+    gt_boxes, gt_class_ids = load_labels(label_path(path), width, height)
+    n_classes = len(_class_map)
+
+    if enhanced is None:
+        enhanced, enhanced_luma = _enhancer.enhance_fused(image)
+    else:
+        enhanced_luma = cv2.cvtColor(enhanced, cv2.COLOR_BGR2GRAY)
+    with span("evaluate.metrics"):
+        metrics = _engine.evaluate(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), enhanced_luma)
+
+    with span("evaluate.detect"):
+        raw_detections, enhanced_detections = _detector([image, enhanced])
+    results = {}
+    for variant, detections in zip(VARIANTS, (raw_detections, enhanced_detections)):
+        boxes, confidences, class_ids = to_dataset_classes(detections)
+        with span("evaluate.match"):
+            tp, bins = match(boxes, confidences, class_ids, gt_boxes, gt_class_ids, n_classes)
+        results[variant] = (tp, bins, class_ids, confidences)
+    return {
+        "path": path,
+        "entropy_original": metrics.entropy_original,
+        "entropy_enhanced": metrics.entropy_enhanced,
+        "cii": metrics.cii,
+        "gt_class_ids": gt_class_ids,
+        "detections": results,
+        "events": tracer.drain() if tracer.enabled else None,
+    }
+
+
+def run_evaluation(inputs, output_dir, names=VEHICLE_CLASSES, weights="best.pt", stub_detector=False,
+                   conf=EVAL_CONF, report_conf=REPORT_CONF, gamma_mode="content", gamma=0.75, seed=0,
+                   workers=None, max_inflight=None, report_every=100, store_path=None):
+    # `inputs` are (path, name) pairs from collect_inputs, or ignored when
+    # store_path names a frame store, whose frames are evaluated instead
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    max_inflight = max_inflight or workers * 2
+    accumulators = {variant: DetectionAccumulator(len(names)) for variant in VARIANTS}
+    distributions = {
+        "entropy_original": Distribution(ENTROPY_BINS),
+        "entropy_enhanced": Distribution(ENTROPY_BINS),
+        "cii": Distribution(CII_BINS),
+    }
+
+    processed = failed = 0
+    start = time.perf_counter()
+    enhancement = {"source": "evaluation", "gamma_mode": gamma_mode, "gamma": gamma, "seed": seed}
+    store_metadata = None
+    if store_path:
+        with FrameStore(store_path) as store:
+            inputs = range(len(store))
+            store_metadata = dict(store.metadata, path=os.path.abspath(store_path))
+            if store.has_enhanced:
+                # Enhanced frames come from the store, made with its settings
+                enhancement = {"source": "frame store", **{key: store.metadata.get(key)
+                                                            for key in ("gamma_mode", "gamma", "seed", "max_size")}}
+        paths = iter(inputs)
+    else:
+        paths = iter(path for path, _ in inputs)
+    next_path = next(paths, None)
+    inflight = set()
+
+    with open(os.path.join(output_dir, "images.csv"), "w", newline="") as images_file, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                initargs=(tuple(names), weights, stub_detector, conf, gamma_mode, gamma, seed,
+                                          tracer.enabled, store_path)) as pool:
+        # One row per image, written as results arrive
+        rows = csv.writer(images_file)
+        rows.writerow(["image", "entropy_original", "entropy_enhanced", "cii", "objects",
+                       *(f"{variant}_{field}" for variant in VARIANTS for field in ("detections", "tp50"))])
+        while next_path is not None or inflight:
+            while next_path is not None and len(inflight) < max_inflight:
+                inflight.add(pool.submit(evaluate_file, next_path))
+                next_path = next(paths, None)
+
+            finished, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Failed: {e}", file=sys.stderr)
+                    continue
+                if result["events"]:
+                    tracer.merge(result["events"])
+                for name, distribution in distributions.items():
+                    distribution.add(result[name])
+                row = [result["path"], result["entropy_original"], result["entropy_enhanced"], result["cii"],
+                       len(result["gt_class_ids"])]
+                for variant in VARIANTS:
+                    tp, bins, class_ids, confidences = result["detections"][variant]
+                    accumulators[variant].add(tp, bins, class_ids, result["gt_class_ids"])
+                    reported = confidences >= report_conf
+                    row += [int(reported.sum()), int(tp[0, reported].sum())]
+                rows.writerow(row)
+                processed += 1
+                if report_every and processed % report_every == 0:
+                    elapsed = time.perf_counter() - start
+                    print(f"{processed}/{len(inputs)} images, {processed / elapsed:.2f} images/sec")
+
+    summary = {
+        "images": processed,
+        "failed": failed,
+        "classes": list(names),
+        "conf": conf,
+        "report_conf": report_conf,
+        "gamma_mode": enhancement["gamma_mode"],
+        "enhancement": enhancement,
+        "store": store_metadata,
+        "metrics": {name: d.summary() for name, d in distributions.items()},
+        "detection": {},
+    }
+    with open(os.path.join(output_dir, "classes.csv"), "w", newline="") as classes_file:
+        rows = csv.writer(classes_file)
+        rows.writerow(["variant", "class", "objects", "detections", "precision", "recall", "ap50", "ap50_95"])
+        for variant in VARIANTS:
+            s = accumulators[variant].summary(report_conf)
+            per_class = {}
+            for c, name in enumerate(names):
+                per_class[name] = {key: float(s[key][c]) if key.startswith(("ap", "pre", "rec")) else int(s[key][c])
+                                   for key in s}
+                rows.writerow([variant, name, int(s["n_gt"][c]), int(s["n_detections"][c]),
+                               f"{s['precision'][c]:.4f}", f"{s['recall'][c]:.4f}",
+                               f"{s['ap50'][c]:.4f}", f"{s['ap50_95'][c]:.4f}"])
+            # Classes without labels do not count towards the mean
+            labelled = s["n_gt"] > 0
+            summary["detection"][variant] = {
+                "map50": float(s["ap50"][labelled].mean()) if labelled.any() else 0.0,
+                "map50_95": float(s["ap50_95"][labelled].mean()) if labelled.any() else 0.0,
+                "classes": per_class,
+            }
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2, allow_nan=False)
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {processed} evaluated, {failed} failed in {elapsed:.1f}s")
+    for variant in VARIANTS:
+        d = summary["detection"][variant]
+        print(f"{variant:<9} mAP50 {d['map50']:.4f}  mAP50-95 {d['map50_95']:.4f}")
+    for name, d in summary["metrics"].items():
+        non_finite = f"  ({d['non_finite']} non-finite)" if d["non_finite"] else ""
+        if d["count"]:
+            print(f"{name:<17} mean {d['mean']:.4f}  p50 {d['p50']:.4f}  p95 {d['p95']:.4f}{non_finite}")
+        elif non_finite:
+            print(f"{name:<17}{non_finite}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score enhancement metrics and detection accuracy on raw "
+                                                 "and enhanced images of a YOLO format dataset.")
+    parser.add_argument("inputs", nargs="+", help="image directories, image files or text files listing image paths, "
+                        "or one frame store (see framestore.py); labels are read from the matching labels/ "
+                        "directory or a .txt next to each source image")
+    parser.add_argument("-o", "--output", required=True, help="directory for images.csv, classes.csv and summary.json")
+    parser.add_argument("--names", nargs="+", default=list(VEHICLE_CLASSES), help="dataset class names in id order")
+    parser.add_argument("--weights", default="best.pt", help="YOLO weights (.pt or .onnx)")
+    parser.add_argument("--stub-detector", action="store_true", help="use a fake detector instead of YOLO")
+    parser.add_argument("--conf", type=float, default=EVAL_CONF, help="detector confidence threshold for mAP")
+    parser.add_argument("--report-conf", type=float, default=REPORT_CONF,
+                        help="confidence for the reported precision and recall")
+    parser.add_argument("--gamma-mode", choices=GAMMA_MODES, default="content")
+    parser.add_argument("--gamma", type=float, default=0.75)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--max-inflight", type=int, default=None, help="maximum queued images (default: 2 x workers)")
+    parser.add_argument("--report-every", type=int, default=100, help="print throughput every N images")
+    parser.add_argument("--trace", metavar="PATH", help="write a Chrome trace of every stage to PATH")
+    args = parser.parse_args(argv)
+    enable_from_args(args.trace)
+
+    store_path = args.inputs[0] if len(args.inputs) == 1 and is_store(args.inputs[0]) else None
+    inputs = [] if store_path else collect_inputs(args.inputs)
+    if not inputs and not store_path:
+        parser.error("no images found")
+    summary = run_evaluation(
+        inputs, args.output,
+        names=args.names,
+        weights=args.weights,
+        stub_detector=args.stub_detector,
+        conf=args.conf,
+        report_conf=args.report_conf,
+        gamma_mode=args.gamma_mode,
+        gamma=args.gamma,
+        seed=args.seed,
+        workers=args.workers,
+        max_inflight=args.max_inflight,
+        report_every=args.report_every,
+        store_path=store_path,
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
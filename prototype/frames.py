@@ -0,0 +1,107 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+from enhancement import content_hash
+from tracing import span
+
+DISPLAY_SIZE = (380, 280)
+
+
+def pil_to_cv2(pil_image):
+    # np.asarray shares the PIL buffer, cvtColor makes the only copy
+    img_array = np.asarray(pil_image)
+    if len(img_array.shape) == 2:  # Grayscale
+        return cv2.cvtColor(img_array, cv2.COLOR_GRAY2BGR)
+    elif img_array.shape[2] == 3:  # RGB
+        return cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+    elif img_array.shape[2] == 4:  # RGBA
+        return cv2.cvtColor(img_array, cv2.COLOR_RGBA2BGR)
+    return img_array
+
+
+def cv2_to_pil(cv_image):
+    rgb_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
+    return Image.fromarray(rgb_image)
+
+
+class Frame:
+    # One BGR ndarray plus the views the app needs from it. Each view is
+    # derived on first use and cached, so an image is converted to
+    # grayscale, RGB or a thumbnail at most once however many pages use it.
+    # The pixels must not be modified after a view has been taken. `gray`
+    # may be passed in when it is already known, e.g. the enhanced luma.
+    def __init__(self, bgr, gray=None):
+        self.bgr = bgr
+        self._gray = gray
+        self._hash = None
+        self._pil = None
+        self._thumbnails = {}
+        self._photo_images = {}
+
+    @classmethod
+    def from_pil(cls, pil_image):
+        if pil_image.mode not in ("RGB", "RGBA", "L"):
+            pil_image = pil_image.convert("RGB")
+        return cls(pil_to_cv2(pil_image))
+
+    @classmethod
+    def from_path(cls, path):
+        # OpenCV decodes straight to BGR; PIL covers formats it cannot read (GIF).
+        # Like PIL, the EXIF orientation is not applied, so rotated JPEGs come
+        # out the same way on both paths and as the GUI always loaded them.
+        bgr = cv2.imread(path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if bgr is not None:
+            return cls(bgr)
+        with Image.open(path) as pil_image:
+            return cls.from_pil(pil_image)
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            with span("frame.gray"):
+                self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def content_hash(self):
+        if self._hash is None:
+            self._hash = content_hash(self.bgr)
+        return self._hash
+
+    @property
+    def pil(self):
+        # Full resolution PIL image, only needed for export
+        if self._pil is None:
+            self._pil = cv2_to_pil(self.bgr)
+        return self._pil
+
+    def thumbnail(self, size=DISPLAY_SIZE):
+        # Shrinks the BGR array first so the colour conversion only touches
+        # display-sized pixels. Keeps the aspect ratio and never enlarges,
+        # like PIL's Image.thumbnail.
+        thumbnail = self._thumbnails.get(size)
+        if thumbnail is None:
+            with span("frame.thumbnail"):
+                height, width = self.bgr.shape[:2]
+                scale = min(size[0] / width, size[1] / height, 1.0)
+                small = self.bgr
+                if scale < 1.0:
+                    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+                    small = cv2.resize(self.bgr, new_size, interpolation=cv2.INTER_AREA)
+                thumbnail = cv2_to_pil(small)
+            self._thumbnails[size] = thumbnail
+        return thumbnail
+
+    def photo_image(self, size=DISPLAY_SIZE):
+        # Tk images must be created on the Tk thread
+        photo = self._photo_images.get(size)
+        if photo is None:
+            from PIL import ImageTk
+            photo = ImageTk.PhotoImage(self.thumbnail(size))
+            self._photo_images[size] = photo
+        return photo
@@ -0,0 +1,307 @@
+import argparse
+import json
+import mmap
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from batch import collect_inputs
+from enhancement import GAMMA_MODES, Enhancer
+from frames import Frame
+
+# A store is a directory with every frame's BGR bytes back to back in
+# frames.bin, a fixed-size index.npy describing where each one starts and
+# its shape, and entries.json with the names and source paths.
+DATA_NAME = "frames.bin"
+INDEX_NAME = "index.npy"
+ENTRIES_NAME = "entries.json"
+STORE_VERSION = 1
+# Frames start on cache line boundaries
+ALIGNMENT = 64
+
+INDEX_DTYPE = np.dtype([
+    ("offset", np.int64),
+    ("enhanced_offset", np.int64),  # -1 when no enhanced output was stored
+    ("height", np.int32),
+    ("width", np.int32),
+    ("channels", np.int32),
+])
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, INDEX_NAME))
+
+
+class FrameStoreWriter:
+    # Appends frames with plain writes; the index is written on close, so a
+    # store is only readable once it is complete
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._data = open(os.path.join(path, DATA_NAME), "wb")
+        self._index = []
+        self._entries = []
+
+    def _append(self, array):
+        position = self._data.tell()
+        padding = -position % ALIGNMENT
+        if padding:
+            self._data.write(b"\0" * padding)
+        offset = position + padding
+        self._data.write(np.ascontiguousarray(array, dtype=np.uint8).data)
+        return offset
+
+    def add(self, name, bgr, enhanced=None, source=None):
+        if bgr.ndim == 2:
+            bgr = bgr[:, :, None]
+        offset = self._append(bgr)
+        enhanced_offset = -1
+        if enhanced is not None:
+            if enhanced.shape[:2] != bgr.shape[:2]:
+                raise ValueError(f"Enhanced frame for {name} is {enhanced.shape}, expected {bgr.shape}")
+            enhanced_offset = self._append(enhanced.reshape(bgr.shape))
+        self._index.append((offset, enhanced_offset, *bgr.shape))
+        self._entries.append({"name": name, "source": source})
+        return len(self._index) - 1
+
+    def close(self, metadata=None):
+        self._data.close()
+        np.save(os.path.join(self.path, INDEX_NAME), np.array(self._index, dtype=INDEX_DTYPE))
+        with open(os.path.join(self.path, ENTRIES_NAME), "w") as f:
+            json.dump({"version": STORE_VERSION, "metadata": metadata or {}, "entries": self._entries}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class FrameStore:
+    # Read-only, memory-mapped view of a store. Frames come back as numpy
+    # views into the mapping: no decoding and no copy, and processes that
+    # open the same store share the page cache. The arrays are read-only;
+    # copy one before modifying it. Pickles by path, so it can be handed to
+    # worker processes, which map the file again.
+    def __init__(self, path, access="random"):
+        self.path = path
+        self.index = np.load(os.path.join(path, INDEX_NAME))
+        with open(os.path.join(path, ENTRIES_NAME)) as f:
+            entries = json.load(f)
+        self.metadata = entries.get("metadata", {})
+        self.entries = entries["entries"]
+        self._names = None
+        self._file = open(os.path.join(path, DATA_NAME), "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._buffer = np.frombuffer(self._mmap, dtype=np.uint8) if size else np.zeros(0, dtype=np.uint8)
+        self.advise(access)
+
+    def advise(self, access):
+        # Tells the kernel how frames will be read: "random" turns off
+        # read-ahead, "sequential" makes it more aggressive
+        advice = {"random": "MADV_RANDOM", "sequential": "MADV_SEQUENTIAL"}[access]
+        if self._mmap is not None and hasattr(mmap, advice):
+            self._mmap.madvise(getattr(mmap, advice))
+
+    def __reduce__(self):
+        return FrameStore, (self.path,)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _view(self, offset, row):
+        shape = (int(row["height"]), int(row["width"]), int(row["channels"]))
+        frame = self._buffer[offset:offset + shape[0] * shape[1] * shape[2]].reshape(shape)
+        return frame[:, :, 0] if shape[2] == 1 else frame
+
+    def __getitem__(self, i):
+        row = self.index[i]
+        return self._view(int(row["offset"]), row)
+
+    def enhanced(self, i):
+        row = self.index[i]
+        if row["enhanced_offset"] < 0:
+            return None
+        return self._view(int(row["enhanced_offset"]), row)
+
+    @property
+    def has_enhanced(self):
+        return bool(len(self.index)) and bool((self.index["enhanced_offset"] >= 0).all())
+
+    def name(self, i):
+        return self.entries[i]["name"]
+
+    def source(self, i):
+        return self.entries[i]["source"]
+
+    def find(self, name):
+        if self._names is None:
+            self._names = {entry["name"]: i for i, entry in enumerate(self.entries)}
+        return self._names[name]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def sequential(self, start=0, stop=None, enhanced=False):
+        # (index, frame) in store order, with read-ahead
+        self.advise("sequential")
+        try:
+            for i in range(start, len(self) if stop is None else min(stop, len(self))):
+                yield i, self.enhanced(i) if enhanced else self[i]
+        finally:
+            self.advise("random")
+
+    def close(self):
+        self._buffer = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Views handed out are still alive; the mapping goes with them
+                pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+_enhancer = None
+
+
+def init_worker(gamma_mode, gamma, seed, enhance):
+    global _enhancer
+    cv2.setNumThreads(1)
+    _enhancer = Enhancer(gamma_mode=gamma_mode, gamma=gamma, seed=seed) if enhance else None
+
+
+def decode_file(path, max_size=None):
+    bgr = Frame.from_path(path).bgr
+    height, width = bgr.shape[:2]
+    if max_size and max(height, width) > max_size:
+        scale = max_size / max(height, width)
+        bgr = cv2.resize(bgr, (max(1, round(width * scale)), max(1, round(height * scale))),
+                         interpolation=cv2.INTER_AREA)
+    enhanced = _enhancer.enhance(bgr) if _enhancer is not None else None
+    return bgr, enhanced
+
+
+def convert(inputs, path, max_size=None, enhance=False, gamma_mode="content", gamma=0.75, seed=0,
+            workers=None, chunk=64, report_every=1000):
+    # Decodes (and optionally downscales and enhances) a folder of images
+    # once into a store. Images are decoded in parallel a chunk at a time,
+    # in input order, so memory is bounded by the chunk.
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    written = failed = 0
+    metadata = {"max_size": max_size, "enhanced": enhance,
+                "gamma_mode": gamma_mode if enhance else None, "gamma": gamma if enhance else None,
+                "seed": seed if enhance else None}
+    writer = FrameStoreWriter(path)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(gamma_mode, gamma, seed, enhance)) as pool:
+        for begin in range(0, len(inputs), chunk):
+            batch = inputs[begin:begin + chunk]
+            futures = [pool.submit(decode_file, source, max_size) for source, _ in batch]
+            for (source, name), future in zip(batch, futures):
+                try:
+                    bgr, enhanced = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Failed {source}: {e}", file=sys.stderr)
+                    continue
+                writer.add(name, bgr, enhanced, source=os.path.abspath(source))
+                written += 1
+                if report_every and written % report_every == 0:
+                    print(f"{written}/{len(inputs)} frames, {written / (time.perf_counter() - start):.1f} frames/sec")
+    writer.close(metadata)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(os.path.join(path, DATA_NAME))
+    print(f"Done: {written} frames ({size / 2 ** 20:.1f} MB), {failed} failed in {elapsed:.1f}s")
+    return written, failed
+
+
+def bench(args):
+    # Compares decoding the source images against reading the store
+    with FrameStore(args.store) as store:
+        n = min(args.frames, len(store))
+        sources = [store.source(i) for i in range(n)]
+        start = time.perf_counter()
+        for source in sources:
+            Frame.from_path(source)
+        decode = time.perf_counter() - start
+
+        order = np.random.default_rng(0).permutation(n)
+        start = time.perf_counter()
+        for i in order:
+            # Touch the pixels, a view alone reads nothing
+            int(store[i][::16, ::16].sum())
+        random_read = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _, frame in store.sequential(0, n):
+            int(frame[::16, ::16].sum())
+        sequential_read = time.perf_counter() - start
+    print(f"decode from source: {n / decode:10.1f} frames/sec")
+    print(f"store random:       {n / random_read:10.1f} frames/sec")
+    print(f"store sequential:   {n / sequential_read:10.1f} frames/sec")
+    return 0
+
+
+def info(args):
+    with FrameStore(args.store) as store:
+        size = os.path.getsize(os.path.join(args.store, DATA_NAME))
+        shapes = {tuple(int(v) for v in row[["height", "width", "channels"]]) for row in store.index}
+        print(f"{len(store)} frames, {size / 2 ** 20:.1f} MB, enhanced outputs: {store.has_enhanced}")
+        print(f"shapes: {sorted(shapes)[:10]}{' ...' if len(shapes) > 10 else ''}")
+        print(f"metadata: {store.metadata}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory-mapped store of decoded frames.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = commands.add_parser("convert", help="decode image folders into a store")
+    convert_parser.add_argument("inputs", nargs="+", help="image directories, image files or text files listing image paths")
+    convert_parser.add_argument("-o", "--output", required=True, help="store directory")
+    convert_parser.add_argument("--max-size", type=int, help="downscale so the longer side is at most this")
+    convert_parser.add_argument("--enhance", action="store_true", help="also store the enhanced frames")
+    convert_parser.add_argument("--gamma-mode", choices=GAMMA_MODES, default="content")
+    convert_parser.add_argument("--gamma", type=float, default=0.75)
+    convert_parser.add_argument("--seed", type=int, default=0)
+    convert_parser.add_argument("-j", "--workers", type=int, default=None)
+    convert_parser.add_argument("--report-every", type=int, default=1000)
+
+    for name, text in (("info", "describe a store"), ("bench", "compare decoding against reading the store")):
+        command = commands.add_parser(name, help=text)
+        command.add_argument("store")
+        if name == "bench":
+            command.add_argument("-n", "--frames", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        return info(args)
+    if args.command == "bench":
+        return bench(args)
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        parser.error("no images found")
+    _, failed = convert(inputs, args.output, max_size=args.max_size, enhance=args.enhance,
+                        gamma_mode=args.gamma_mode, gamma=args.gamma, seed=args.seed,
+                        workers=args.workers, report_every=args.report_every)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
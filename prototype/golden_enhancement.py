@@ -0,0 +1,141 @@
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from enhancement import CLIP_LIMIT, TILE_GRID_SIZE, Enhancer
+from metrics import MetricsEngine
+from synthetic import CONDITIONS, synthetic_frame
+
+# Committed input frames and the original apply_enhancement output for each
+# at fixed gammas, which enhance() and enhance_fused() must reproduce
+# exactly. The inputs are read back from disk rather than regenerated, so the
+# check does not depend on synthetic.py or numpy's random generator. Small
+# frames keep the repository light; 90x150 does not divide into the CLAHE grid.
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+INPUTS = "inputs"
+SIZES = ((90, 150), (144, 256))
+GAMMAS = (0.5, 0.75, 1.0)
+
+# The Y-only gamma variant is an approximation and only has to stay this
+# close to the reference. Its error grows as CLAHE tiles shrink, so it is
+# measured on full-size frames rather than the small golden ones.
+APPROXIMATION_SIZES = ((720, 1280), (1080, 1920))
+LUMA_GAMMA_MIN_PSNR = 25.0
+# Entropy of the returned luma against the grayscale of the output
+LUMA_ENTROPY_TOLERANCE = 0.01
+
+
+def synthetic_inputs(sizes):
+    for height, width in sizes:
+        for condition in CONDITIONS:
+            yield f"{condition}_{height}p", synthetic_frame(height, width, condition, seed=height)
+
+
+def golden_name(name, gamma):
+    return f"{name}_gamma{gamma:g}"
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def reference_enhancement(image, gamma):
+    # The original apply_enhancement step by step, with the random gamma
+    # replaced by a fixed one. bench_enhancement times it as the baseline.
+    gamma_table = np.array([((i / 255.0) ** gamma) * 255
+                            for i in np.arange(0, 256)]).astype("uint8")
+    gamma_corrected_image = cv2.LUT(image, gamma_table)
+    ycrcb_image = cv2.cvtColor(gamma_corrected_image, cv2.COLOR_BGR2YCrCb)
+    y, cr, cb = cv2.split(ycrcb_image)
+    clahe = cv2.createCLAHE(clipLimit=CLIP_LIMIT, tileGridSize=TILE_GRID_SIZE)
+    clahe_y = clahe.apply(y)
+    clahe_ycrcb = cv2.merge([clahe_y, cr, cb])
+    return cv2.cvtColor(clahe_ycrcb, cv2.COLOR_YCrCb2BGR)
+
+
+def record(args):
+    # Writes each input frame and its reference output for every gamma as
+    # lossless PNG. Only needed again if the cases change; the committed
+    # images are the test.
+    os.makedirs(os.path.join(args.golden, INPUTS), exist_ok=True)
+    for name, image in synthetic_inputs(SIZES):
+        cv2.imwrite(os.path.join(args.golden, INPUTS, name + ".png"), image)
+        for gamma in GAMMAS:
+            cv2.imwrite(os.path.join(args.golden, golden_name(name, gamma) + ".png"),
+                        reference_enhancement(image, gamma))
+        print(f"recorded {name}")
+    return 0
+
+
+def read_image(path):
+    return cv2.imread(path, cv2.IMREAD_COLOR) if os.path.exists(path) else None
+
+
+def check(args):
+    enhancer = Enhancer()
+    engine = MetricsEngine()
+    failed = False
+    input_dir = os.path.join(args.golden, INPUTS)
+    inputs = sorted(f for f in os.listdir(input_dir) if f.endswith(".png")) if os.path.isdir(input_dir) else []
+    if not inputs:
+        print(f"no golden inputs in {input_dir}")
+        failed = True
+    print(f"{'golden case':<28}{'enhance':>9}{'fused':>7}")
+    for filename in inputs:
+        image = read_image(os.path.join(input_dir, filename))
+        for gamma in GAMMAS:
+            name = golden_name(os.path.splitext(filename)[0], gamma)
+            path = os.path.join(args.golden, name + ".png")
+            golden = read_image(path)
+            if image is None or golden is None:
+                print(f"{name:<28}  MISSING {path if image is not None else filename}")
+                failed = True
+                continue
+            enhance_exact = np.array_equal(enhancer.enhance(image, gamma=gamma), golden)
+            fused_exact = np.array_equal(enhancer.enhance_fused(image, gamma=gamma)[0], golden)
+            failed |= not (enhance_exact and fused_exact)
+            print(f"{name:<28}{'same' if enhance_exact else 'DIFF':>9}{'same' if fused_exact else 'DIFF':>7}")
+
+    print(f"\n{'approximation case':<28}{'luma max':>9}{'luma psnr':>11}{'dH luma':>9}")
+    for input_name, image in synthetic_inputs(APPROXIMATION_SIZES):
+        for gamma in GAMMAS:
+            name = golden_name(input_name, gamma)
+            reference = reference_enhancement(image, gamma)
+            fused, luma = enhancer.enhance_fused(image, gamma=gamma)
+            approx, _ = enhancer.enhance_fused(image, gamma=gamma, luma_gamma=True)
+            approx_psnr = psnr(approx, reference)
+            max_diff = int(np.abs(approx.astype(np.int16) - reference).max())
+            gray = cv2.cvtColor(fused, cv2.COLOR_BGR2GRAY)
+            entropy_diff = abs(engine.entropy(engine.histogram(luma)) - engine.entropy(engine.histogram(gray)))
+
+            flags = []
+            if approx_psnr < LUMA_GAMMA_MIN_PSNR:
+                flags.append("LUMA GAMMA PSNR")
+            if entropy_diff > LUMA_ENTROPY_TOLERANCE:
+                flags.append("LUMA ENTROPY")
+            failed |= bool(flags)
+            print(f"{name:<28}{max_diff:>9}{approx_psnr:>11.2f}{entropy_diff:>9.4f}  {' '.join(flags)}")
+    print("FAILED" if failed else "OK")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare enhance() and the fused enhancement path against "
+                                                 "golden images of the original apply_enhancement output.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="write golden inputs and reference outputs")
+    record_parser.add_argument("golden", help="output directory")
+    record_parser.set_defaults(func=record)
+    check_parser = commands.add_parser("check", help="compare enhance() and enhance_fused() against the golden images")
+    check_parser.add_argument("--golden", default=GOLDEN_DIR, help="golden image directory")
+    check_parser.set_defaults(func=check)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import sys
+import threading
+import time
+from collections import deque
+from typing import NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+from detection import IMGSZ
+from enhancement import TILE_GRID_SIZE
+from metrics import MetricsEngine
+
+
+class Tier(NamedTuple):
+    name: str
+    scale: float                    # input downscale before enhancement and detection
+    tile_grid_size: tuple           # CLAHE tiles; fewer tiles are cheaper
+    imgsz: int                      # detection input size, a multiple of 32 (dynamic models only)
+    skip_entropy: Optional[float]   # skip enhancement at or above this entropy, None never skips
+
+
+# Ordered from best quality to cheapest
+DEFAULT_TIERS = (
+    Tier("full", 1.0, TILE_GRID_SIZE, IMGSZ, None),
+    Tier("coarse-clahe", 1.0, (8, 16), IMGSZ, None),
+    Tier("skip-exposed", 1.0, (8, 16), IMGSZ, 7.0),
+    Tier("small-detect", 1.0, (8, 8), 480, 6.8),
+    Tier("downscale", 0.75, (8, 8), 416, 6.8),
+    Tier("minimum", 0.5, (4, 8), 320, 6.5),
+)
+
+# Latency relative to the deadline that steps down a tier, and below which
+# it is safe to step back up
+DEGRADE_AT = 1.0
+RECOVER_AT = 0.6
+# Samples per stage needed before a decision, and consecutive calm windows
+# before stepping back up, so that one quiet moment does not flip-flop
+WINDOW = 30
+RECOVER_WINDOWS = 3
+PERCENTILE = 95
+# Downscaled size the entropy check runs on
+ENTROPY_PROBE_WIDTH = 320
+
+
+def log_tier_change(governor, old, new, pressure):
+    print(f"governor: {old.name} -> {new.name} (p{PERCENTILE} {pressure:.0%} of the "
+          f"{governor.deadline * 1000:.1f} ms deadline)", file=sys.stderr)
+
+
+class QualityGovernor:
+    # Watches per-stage latency and trades quality for staying within a
+    # per-frame deadline. Each stage reports its latencies through
+    # observe(); once every stage has WINDOW fresh samples, the slowest
+    # stage's p95 decides: above DEGRADE_AT x deadline moves one tier down,
+    # below RECOVER_AT x deadline for RECOVER_WINDOWS windows in a row moves
+    # one tier up. Samples are cleared on every change so the next decision
+    # only sees the new tier. Every change is passed to `log` and kept in
+    # `changes`.
+    def __init__(self, deadline, enhancer, tiers=DEFAULT_TIERS, window=WINDOW, degrade_at=DEGRADE_AT,
+                 recover_at=RECOVER_AT, recover_windows=RECOVER_WINDOWS, log=log_tier_change):
+        self.deadline = deadline
+        self.tiers = tuple(tiers)
+        self.window = window
+        self.degrade_at = degrade_at
+        self.recover_at = recover_at
+        self.recover_windows = recover_windows
+        self.log = log
+        self.level = 0
+        self.changes = []
+        self.skipped = 0
+        self._base_enhancer = enhancer
+        # Keyframe interval of the detector before the first configure()
+        self._base_interval = None
+        # Tile grid -> enhancer used at tiers with that grid
+        self.enhancers = {}
+        self._latencies = {}
+        self._calm = 0
+        self._engine = MetricsEngine()
+        self._lock = threading.Lock()
+
+    @property
+    def tier(self):
+        return self.tiers[self.level]
+
+    @property
+    def enhancer(self):
+        # One enhancer per tile grid, built on first use
+        tile_grid_size = tuple(self.tier.tile_grid_size)
+        enhancer = self.enhancers.get(tile_grid_size)
+        if enhancer is None:
+            enhancer = self._base_enhancer.replace(tile_grid_size=tile_grid_size)
+            self.enhancers[tile_grid_size] = enhancer
+        return enhancer
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            latencies = self._latencies.get(stage)
+            if latencies is None:
+                latencies = self._latencies[stage] = deque(maxlen=self.window)
+            latencies.append(seconds)
+            if all(len(values) >= self.window for values in self._latencies.values()):
+                self._decide()
+
+    def _decide(self):
+        pressure = max(np.percentile(values, PERCENTILE) for values in self._latencies.values()) / self.deadline
+        level = self.level
+        if pressure > self.degrade_at and level < len(self.tiers) - 1:
+            level += 1
+        elif pressure < self.recover_at and level > 0:
+            self._calm += 1
+            if self._calm >= self.recover_windows:
+                level -= 1
+        else:
+            self._calm = 0
+        for values in self._latencies.values():
+            values.clear()
+        if level != self.level:
+            old, self.level, self._calm = self.tier, level, 0
+            self.changes.append({"time": time.time(), "from": old.name, "to": self.tier.name,
+                                 "pressure": float(pressure)})
+            if self.log is not None:
+                self.log(self, old, self.tier, pressure)
+
+    def prepare(self, frame):
+        # Downscales the input for the current tier
+        scale = self.tier.scale
+        if scale >= 1.0:
+            return frame
+        height, width = frame.shape[:2]
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    def well_exposed(self, frame):
+        # Entropy of a small grayscale copy, as in Metrics.calculate_entropy
+        threshold = self.tier.skip_entropy
+        if threshold is None:
+            return False
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        if gray.shape[1] > ENTROPY_PROBE_WIDTH:
+            scale = ENTROPY_PROBE_WIDTH / gray.shape[1]
+            gray = cv2.resize(gray, (ENTROPY_PROBE_WIDTH, max(1, round(gray.shape[0] * scale))),
+                              interpolation=cv2.INTER_AREA)
+        return self._engine.entropy(self._engine.histogram(gray)) >= threshold
+
+    def enhance(self, frame):
+        frame = self.prepare(frame)
+        if self.well_exposed(frame):
+            self.skipped += 1
+            return frame
+        return self.enhancer.enhance(frame)
+
+    def configure(self, detector):
+        # Detection cost for the current tier. A model with a dynamic input
+        # runs at the tier's imgsz; a static-shape model (an ONNX export
+        # without dynamic=True) only accepts its own size, so a keyframe
+        # detector instead detects less often by the pixels it would have saved.
+        if getattr(detector, "dynamic_imgsz", False):
+            detector.imgsz = self.tier.imgsz
+        elif hasattr(detector, "interval"):
+            if self._base_interval is None:
+                self._base_interval = detector.interval
+            saving = (self.tiers[0].imgsz / self.tier.imgsz) ** 2
+            detector.interval = max(1, round(self._base_interval * saving))
+        return detector
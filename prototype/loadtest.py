@@ -0,0 +1,89 @@
+import argparse
+import asyncio
+import sys
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("server closed the connection")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+    body = await reader.readexactly(length) if length else b""
+    return status, body
+
+
+async def client(host, port, path, payload, content_type, deadline, latencies, statuses):
+    # One keep-alive connection sending requests back to back
+    reader, writer = await asyncio.open_connection(host, port)
+    request = (f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: {content_type}\r\n"
+               f"Content-Length: {len(payload)}\r\n\r\n").encode() + payload
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, _ = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+            if status == 429:
+                await asyncio.sleep(0.01)
+    finally:
+        writer.close()
+
+
+async def run(args):
+    if args.image:
+        image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+    else:
+        image = np.random.default_rng(0).integers(0, 80, size=(args.height, args.width, 3), dtype=np.uint8)
+    ok, encoded = cv2.imencode(".jpg", image)
+    payload = encoded.tobytes()
+
+    latencies = []
+    statuses = Counter()
+    deadline = time.perf_counter() + args.duration
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client(args.host, args.port, args.path, payload, "image/jpeg", deadline, latencies, statuses)
+        for _ in range(args.concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    ok = statuses.get(200, 0)
+    print(f"{args.path}: {sum(statuses.values())} requests in {elapsed:.1f}s with {args.concurrency} connections")
+    print(f"throughput {ok / elapsed:.1f} ok/s, statuses {dict(statuses)}")
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        print(f"latency p50 {p50:.1f} ms  p95 {p95:.1f} ms  p99 {p99:.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the local inference server over keep-alive connections.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--path", default="/v1/detect")
+    parser.add_argument("--image", help="image to send (default: synthetic frame)")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-d", "--duration", type=float, default=10.0)
+    args = parser.parse_args(argv)
+    asyncio.run(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
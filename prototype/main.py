@@ -1,33 +1,94 @@
+import time
+STARTUP_TIME = time.perf_counter()
+
+import argparse
+import os
 import tkinter as tk
-from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk, ImageDraw
-import cv2
-import numpy as np
-from enhancement import apply_enhancement
-from metrics import Metrics
-from ultralytics import YOLO
-
-def pil_to_cv2(pil_image):
-    img_array = np.array(pil_image)
-    if len(img_array.shape) == 2:  # Grayscale
-        return cv2.cvtColor(img_array, cv2.COLOR_GRAY2BGR)
-    elif img_array.shape[2] == 3:  # RGB
-        return cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-    elif img_array.shape[2] == 4:  # RGBA
-        return cv2.cvtColor(img_array, cv2.COLOR_RGBA2BGR)
-    return img_array
-
-
-def cv2_to_pil(cv_image):
-    rgb_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
-    return Image.fromarray(rgb_image)
+from tkinter import filedialog, messagebox, ttk
+from enhancement import Enhancer
+from metrics import MetricsEngine
+from detection import CONF_THRESHOLD, count_objects, draw_detections
+from workers import BackgroundWorker
+from models import DEFAULT_WEIGHTS, registry
+from backends import WEIGHTS_HELP, load_detector
+from frames import Frame
+from cache import (ResultCache, arrays_to_detections, arrays_to_metrics, cache_key, detection_params,
+                   detections_to_arrays, enhancement_params, metrics_to_arrays)
+from tracing import TRACE_ENV, enable_from_args, span, traced, tracer
+
+
+# --- Background Jobs ---
+# These run on a worker thread and must not touch Tk widgets. Partial
+# results are handed back with post(); token.check() stops a job early
+# once a newer upload or Reset has cancelled it.
+@traced("enhancement_job")
+def enhancement_job(token, post, original_image, enhancer, metrics_engine, result_cache):
+    # Re-uploads of the same pixels with the same parameters come from the cache
+    with span("cache.lookup"):
+        params = enhancement_params(enhancer)
+        key = cache_key("enhancement", original_image.content_hash, **params) if params else None
+        cached = result_cache.get(key) if key else None
+    if cached is not None:
+        enhanced_image = Frame(cached["enhanced"])
+        enhanced_image.thumbnail()
+        post("enhanced", enhanced_image)
+        post("metrics", arrays_to_metrics(cached))
+        return enhanced_image
+
+    gray_original = original_image.gray
+    token.check()
+
+    # Views are cached on the frame, so building the thumbnail here keeps
+    # the resize off the Tk thread. The enhanced luma doubles as its
+    # grayscale view for the metrics.
+    enhanced_image = Frame(*enhancer.enhance_fused(original_image.bgr))
+    enhanced_image.thumbnail()
+    post("enhanced", enhanced_image)
+    token.check()
+
+    metrics = metrics_engine.evaluate(gray_original, enhanced_image.gray)
+    post("metrics", metrics)
+    if key:
+        result_cache.put(key, {"enhanced": enhanced_image.bgr, **metrics_to_arrays(metrics)})
+    return enhanced_image
+
+
+@traced("detection_job")
+def detection_job(token, post, enhanced_image, weights, result_cache):
+    with span("cache.lookup"):
+        key = cache_key("detection", enhanced_image.content_hash, **detection_params(weights, CONF_THRESHOLD))
+        cached = result_cache.get(key)
+    if cached is not None:
+        detections = arrays_to_detections(cached)
+    else:
+        # Waits here if the shared model is still loading in the background
+        detector = load_detector(weights, conf=CONF_THRESHOLD)
+        token.check()
+
+        with span("detect.yolo"):
+            detections = detector([enhanced_image.bgr])[0]
+        token.check()
+        result_cache.put(key, detections_to_arrays(detections))
+    object_counts = count_objects(detections)
+    # The only copy: the enhanced image stays on screen without boxes
+    with span("detect.annotate"):
+        detected_image = Frame(draw_detections(enhanced_image.bgr.copy(), detections))
+    detected_image.thumbnail()
+    return detected_image, object_counts
 
 
 # --- Main Application Controller ---
 class ImageApp(tk.Tk):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, weights=DEFAULT_WEIGHTS, **kwargs):
         tk.Tk.__init__(self, *args, **kwargs)
         
+        # Shared by the pages. Gamma is derived from the image content so the
+        # same upload always gives the same result and can be cached.
+        self.enhancer = Enhancer(gamma_mode="content")
+        self.result_cache = ResultCache()
+        # .pt runs in PyTorch, an exported .onnx in ONNX Runtime
+        self.weights = weights
+        
         self.title("Image Enhancement with Object Detection Prototype")
         self.geometry("900x650")  
         
@@ -36,26 +97,39 @@ class ImageApp(tk.Tk):
         container.grid_rowconfigure(0, weight=1)
         container.grid_columnconfigure(0, weight=1)
 
+        # Pages are built the first time they are needed
+        self.container = container
+        self.pages = {F.__name__: F for F in (StartPage, EnhancementPage, ObjectDetectionPage)}
         self.frames = {}
-        
-        for F in (StartPage, EnhancementPage, ObjectDetectionPage):
-            page_name = F.__name__
-            frame = F(parent=container, controller=self)
-            self.frames[page_name] = frame
-            frame.grid(row=0, column=0, sticky="nsew")
 
         self.show_frame("StartPage")
+
+    def get_page(self, page_name):
+        frame = self.frames.get(page_name)
+        if frame is None:
+            frame = self.pages[page_name](parent=self.container, controller=self)
+            self.frames[page_name] = frame
+            frame.grid(row=0, column=0, sticky="nsew")
+            # A new page is stacked on top; keep it hidden until it is shown
+            frame.lower()
+        return frame
         
     def show_frame(self, page_name, **kwargs):
-        frame = self.frames[page_name]
+        frame = self.get_page(page_name)
         
-        if page_name == "EnhancementPage" and "original_pil_image" in kwargs:
-            frame.prepare_page(kwargs["original_pil_image"])
-        elif page_name == "ObjectDetectionPage" and "enhanced_pil_image" in kwargs:
-            frame.prepare_page(kwargs["enhanced_pil_image"])
+        if page_name == "EnhancementPage" and "original_image" in kwargs:
+            frame.prepare_page(kwargs["original_image"])
+        elif page_name == "ObjectDetectionPage" and "enhanced_image" in kwargs:
+            frame.prepare_page(kwargs["enhanced_image"])
             
         frame.tkraise()
 
+    def cancel_work(self):
+        # Drops any enhancement or detection still running in the background
+        for frame in self.frames.values():
+            if hasattr(frame, "cancel_work"):
+                frame.cancel_work()
+
 
 # --- Start/Upload Page ---
 class StartPage(tk.Frame):
@@ -64,7 +138,7 @@ class StartPage(tk.Frame):
         self.controller = controller
         self.configure(bg="#b0bec5") 
         
-        self.uploaded_image_pil = None
+        self.uploaded_image = None
         self.uploaded_image_tk = None
         self.image_path = None
         
@@ -133,14 +207,12 @@ class StartPage(tk.Frame):
         )
         
         if file_path:
+            self.controller.cancel_work()
             self.image_path = file_path
             try:
-                self.uploaded_image_pil = Image.open(file_path)
+                self.uploaded_image = Frame.from_path(file_path)
                 
-                img_display = self.uploaded_image_pil.copy()
-                img_display.thumbnail((380, 280), Image.Resampling.LANCZOS)
-                
-                self.uploaded_image_tk = ImageTk.PhotoImage(img_display)
+                self.uploaded_image_tk = self.uploaded_image.photo_image()
                 self.upload_area.configure(image=self.uploaded_image_tk, text="")
                 self.upload_area.image = self.uploaded_image_tk
                 
@@ -148,14 +220,15 @@ class StartPage(tk.Frame):
                 messagebox.showerror("Error", f"Could not load image: {str(e)}")
     
     def reset_image_view(self):
+        self.controller.cancel_work()
         self.upload_area.configure(image="", text="Upload Image")
-        self.uploaded_image_pil = None
+        self.uploaded_image = None
         self.uploaded_image_tk = None
         self.image_path = None
     
     def enhance_image_and_switch(self):
-        if self.uploaded_image_pil:
-            self.controller.show_frame("EnhancementPage", original_pil_image=self.uploaded_image_pil)
+        if self.uploaded_image is not None:
+            self.controller.show_frame("EnhancementPage", original_image=self.uploaded_image)
         else:
             messagebox.showwarning("Warning", "Please upload an image first!")
 
@@ -167,13 +240,17 @@ class EnhancementPage(tk.Frame):
         self.controller = controller
         self.configure(bg="#b0bec5") 
         
-        self.original_pil_image = None
-        self.enhanced_pil_image = None
+        self.original_image = None
+        self.enhanced_image = None
         self.original_tk_image = None
         self.enhanced_tk_image = None
         
         # Initialize metrics calculator
-        self.metrics_calculator = Metrics()
+        self.metrics_engine = MetricsEngine()
+        
+        # Enhancement and metrics run off the Tk thread
+        self.worker = BackgroundWorker(self)
+        self.progress = ttk.Progressbar(self, mode="indeterminate", length=300)
         
         # --- Original Image Section ---
         tk.Label(self, text="Original Image", font=("Arial", 16, "bold"), bg="#b0bec5", fg="black").place(relx=0.25, rely=0.08, anchor=tk.CENTER)
@@ -220,14 +297,29 @@ class EnhancementPage(tk.Frame):
         ).place(relx=0.77, rely=0.84, anchor=tk.CENTER)
 
     def go_to_object_detection(self):
-        if self.enhanced_pil_image:
-            self.controller.show_frame("ObjectDetectionPage", enhanced_pil_image=self.enhanced_pil_image)
+        if self.enhanced_image is not None:
+            self.controller.show_frame("ObjectDetectionPage", enhanced_image=self.enhanced_image)
+        elif self.worker.busy:
+            messagebox.showinfo("Please wait", "The image is still being enhanced.")
         else:
             messagebox.showwarning("Warning", "No enhanced image available!")
 
+    def show_progress(self):
+        self.progress.place(relx=0.5, rely=0.59, anchor=tk.CENTER)
+        self.progress.start(10)
+
+    def hide_progress(self):
+        self.progress.stop()
+        self.progress.place_forget()
+
+    def cancel_work(self):
+        self.worker.cancel()
+        self.hide_progress()
+
     def reset_page(self):
-        self.original_pil_image = None
-        self.enhanced_pil_image = None
+        self.cancel_work()
+        self.original_image = None
+        self.enhanced_image = None
         self.original_tk_image = None
         self.enhanced_tk_image = None
         self.original_label.configure(image="")
@@ -237,57 +329,62 @@ class EnhancementPage(tk.Frame):
         self.cii_label.configure(text="Contrast Improvement Index:")
         
         # Clear uploaded image in StartPage
-        start_page = self.controller.frames["StartPage"]
+        start_page = self.controller.get_page("StartPage")
         start_page.reset_image_view()
         
         # Go back to StartPage
         self.controller.show_frame("StartPage")
         
-    def prepare_page(self, original_pil_image):
-        self.original_pil_image = original_pil_image
+    @traced("EnhancementPage.prepare_page")
+    def prepare_page(self, original_image):
+        self.original_image = original_image
+        self.enhanced_image = None
+        self.enhanced_tk_image = None
+        self.enhanced_label.configure(image="")
+        self.entropy_orig.configure(text="Original Entropy:")
+        self.entropy_enh.configure(text="Enhanced Entropy:")
+        self.cii_label.configure(text="Contrast Improvement Index:")
         
         try:
-            # Convert PIL to OpenCV format
-            cv_image = pil_to_cv2(self.original_pil_image)
-            
-            # Convert to grayscale for metrics calculation
-            gray_original = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
-            
-            # Apply enhancement using imported function
-            enhanced_cv_image = apply_enhancement(cv_image)
-            
-            # Convert enhanced to grayscale for metrics
-            gray_enhanced = cv2.cvtColor(enhanced_cv_image, cv2.COLOR_BGR2GRAY)
-            
-            # Convert back to PIL for display
-            self.enhanced_pil_image = cv2_to_pil(enhanced_cv_image)
-            
-            # Calculate metrics
-            entropy_original = self.metrics_calculator.calculate_entropy(gray_original)
-            entropy_enhanced = self.metrics_calculator.calculate_entropy(gray_enhanced)
-            cii_value = self.metrics_calculator.calculate_cii(gray_original, gray_enhanced)
-            
-            # Update metric labels
-            self.entropy_orig.configure(text=f"Original Entropy: {entropy_original:.4f}")
-            self.entropy_enh.configure(text=f"Enhanced Entropy: {entropy_enhanced:.4f}")
-            self.cii_label.configure(text=f"Contrast Improvement Index: {cii_value:.4f}")
-            
-            # Display Original Image
-            img_orig = self.original_pil_image.copy()
-            img_orig.thumbnail((380, 280), Image.Resampling.LANCZOS)
-            self.original_tk_image = ImageTk.PhotoImage(img_orig)
+            # Display Original Image right away
+            self.original_tk_image = self.original_image.photo_image()
             self.original_label.configure(image=self.original_tk_image)
             self.original_label.image = self.original_tk_image
+        except Exception as e:
+            messagebox.showerror("Enhancement Error", f"Failed to display image: {str(e)}")
+            return
+        
+        # Enhance and calculate metrics in the background
+        self.show_progress()
+        self.worker.submit(
+            enhancement_job, self.original_image, self.controller.enhancer, self.metrics_engine,
+            self.controller.result_cache,
+            on_update=self.on_enhancement_update,
+            on_done=lambda result: self.hide_progress(),
+            on_error=self.on_enhancement_error,
+        )
+
+    def on_enhancement_update(self, kind, value):
+        if kind == "enhanced":
+            self.enhanced_image = value
             
             # Display Enhanced Image
-            img_enh = self.enhanced_pil_image.copy()
-            img_enh.thumbnail((380, 280), Image.Resampling.LANCZOS)
-            self.enhanced_tk_image = ImageTk.PhotoImage(img_enh)
+            self.enhanced_tk_image = self.enhanced_image.photo_image()
             self.enhanced_label.configure(image=self.enhanced_tk_image)
             self.enhanced_label.image = self.enhanced_tk_image
             
-        except Exception as e:
-            messagebox.showerror("Enhancement Error", f"Failed to enhance image: {str(e)}")
+            # Start detection early so it is ready when the user asks for it
+            self.controller.get_page("ObjectDetectionPage").start_detection(self.enhanced_image)
+            
+        elif kind == "metrics":
+            # Update metric labels
+            self.entropy_orig.configure(text=f"Original Entropy: {value.entropy_original:.4f}")
+            self.entropy_enh.configure(text=f"Enhanced Entropy: {value.entropy_enhanced:.4f}")
+            self.cii_label.configure(text=f"Contrast Improvement Index: {value.cii:.4f}")
+
+    def on_enhancement_error(self, error):
+        self.hide_progress()
+        messagebox.showerror("Enhancement Error", f"Failed to enhance image: {str(error)}")
 
 
 # --- Object Detection Page ---
@@ -297,17 +394,18 @@ class ObjectDetectionPage(tk.Frame):
         self.controller = controller
         self.configure(bg="#b0bec5")
         
-        self.undetected_pil_image = None
-        self.detected_pil_image = None
+        self.undetected_image = None
+        self.detected_image = None
         self.undetected_tk_image = None
         self.detected_tk_image = None
         
-        # Load YOLO model
-        try:
-            self.model = YOLO('best.pt')  
-        except Exception as e:
-            messagebox.showerror("Model Error", f"Failed to load YOLO model: {str(e)}")
-            self.model = None
+        # Detection runs off the Tk thread; remembers which image it is for
+        self.worker = BackgroundWorker(self)
+        self.detection_source = None
+        self.progress = ttk.Progressbar(self, mode="indeterminate", length=300)
+        
+        # The YOLO model is shared and loaded in the background by the registry
+        self.weights = controller.weights
         
         # --- Undetected Image Section ---
         tk.Label(self, text="Undetected Image", font=("Arial", 16, "bold"), bg="#b0bec5", fg="black").place(relx=0.25, rely=0.08, anchor=tk.CENTER)
@@ -354,114 +452,133 @@ class ObjectDetectionPage(tk.Frame):
             relief=tk.RIDGE, bd=3, cursor="hand2", command=self.reset_page
         ).place(relx=0.77, rely=0.80, anchor=tk.CENTER)
     
-    def reset_page(self):
-        self.undetected_pil_image = None
-        self.detected_pil_image = None
-        self.undetected_tk_image = None
+    def show_progress(self):
+        self.progress.place(relx=0.5, rely=0.59, anchor=tk.CENTER)
+        self.progress.start(10)
+
+    def hide_progress(self):
+        self.progress.stop()
+        self.progress.place_forget()
+
+    def cancel_work(self):
+        self.worker.cancel()
+        self.detection_source = None
+        self.hide_progress()
+
+    def clear_results(self):
+        self.detected_image = None
         self.detected_tk_image = None
-        self.undetected_label.configure(image="")
         self.detected_label.configure(image="")
         self.total_label.configure(text="Number of objects detected: 0")
         self.bus_label.configure(text="Bus: 0")
         self.cars_label.configure(text="Cars: 0")
         self.motor_label.configure(text="Motor: 0")
         self.truck_label.configure(text="Truck: 0")
+
+    def reset_page(self):
+        self.cancel_work()
+        self.undetected_image = None
+        self.undetected_tk_image = None
+        self.undetected_label.configure(image="")
+        self.clear_results()
         
         # Clear all previous pages
-        start_page = self.controller.frames["StartPage"]
+        start_page = self.controller.get_page("StartPage")
         start_page.reset_image_view()
         
-        enhancement_page = self.controller.frames["EnhancementPage"]
-        enhancement_page.original_pil_image = None
-        enhancement_page.enhanced_pil_image = None
+        enhancement_page = self.controller.get_page("EnhancementPage")
+        enhancement_page.original_image = None
+        enhancement_page.enhanced_image = None
         
         # Go back to StartPage
         self.controller.show_frame("StartPage")
+
+    def start_detection(self, enhanced_image):
+        # Already running or finished for this image
+        if registry.error(self.weights) is not None or enhanced_image is self.detection_source:
+            return
+        self.clear_results()
+        self.detection_source = enhanced_image
+        self.show_progress()
+        self.worker.submit(
+            detection_job, enhanced_image, self.weights, self.controller.result_cache,
+            on_done=self.on_detection_done,
+            on_error=self.on_detection_error,
+        )
     
-    def prepare_page(self, enhanced_pil_image):
-        self.undetected_pil_image = enhanced_pil_image
+    @traced("ObjectDetectionPage.prepare_page")
+    def prepare_page(self, enhanced_image):
+        self.undetected_image = enhanced_image
         
         try:
             # Display Undetected Image
-            img_undetected = self.undetected_pil_image.copy()
-            img_undetected.thumbnail((380, 280), Image.Resampling.LANCZOS)
-            self.undetected_tk_image = ImageTk.PhotoImage(img_undetected)
+            self.undetected_tk_image = self.undetected_image.photo_image()
             self.undetected_label.configure(image=self.undetected_tk_image)
             self.undetected_label.image = self.undetected_tk_image
-            
-            # Perform object detection
-            if self.model:
-                # Convert PIL to OpenCV format for YOLO
-                cv_image = pil_to_cv2(self.undetected_pil_image)
-                
-                # Run YOLO detection
-                results = self.model(cv_image, conf=0.25)  # confidence threshold 0.25
-                
-                # Initialize counters
-                object_counts = {'bus': 0, 'car': 0, 'motor': 0, 'truck': 0}
-                
-                # Create a copy of the image for drawing
-                detected_cv_image = cv_image.copy()
-                
-                # Process detections
-                for result in results:
-                    boxes = result.boxes
-                    for box in boxes:
-                        # Get box coordinates
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-                        
-                        # Get class name and confidence
-                        cls = int(box.cls[0])
-                        conf = float(box.conf[0])
-                        class_name = result.names[cls].lower()
-                        
-                        # Count objects
-                        if class_name in object_counts:
-                            object_counts[class_name] += 1
-                        
-                        # Draw bounding box
-                        cv2.rectangle(detected_cv_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                        
-                        # Draw label with class name and confidence
-                        label = f"{class_name}: {conf:.2f}"
-                        (text_width, text_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
-                        cv2.rectangle(detected_cv_image, (x1, y1 - text_height - 10), (x1 + text_width, y1), (0, 255, 0), -1)
-                        cv2.putText(detected_cv_image, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
-                
-                # Convert detected image back to PIL
-                self.detected_pil_image = cv2_to_pil(detected_cv_image)
-                
-                # Calculate total
-                total_objects = sum(object_counts.values())
-                
-                # Update detection counts with proper formatting
-                self.total_label.configure(text=f"Number of objects detected: {total_objects}")
-                self.bus_label.configure(text=f"Bus: {object_counts['bus']}")
-                self.cars_label.configure(text=f"Cars: {object_counts['car']}")
-                self.motor_label.configure(text=f"Motor: {object_counts['motor']}")
-                self.truck_label.configure(text=f"Truck: {object_counts['truck']}")
-                
-                # Display Detection Image
-                img_detected = self.detected_pil_image.copy()
-                img_detected.thumbnail((380, 280), Image.Resampling.LANCZOS)
-                self.detected_tk_image = ImageTk.PhotoImage(img_detected)
-                self.detected_label.configure(image=self.detected_tk_image)
-                self.detected_label.image = self.detected_tk_image
-                
-                # Print to console for debugging
-                print(f"Detection Results: Total={total_objects}, Bus={object_counts['bus']}, Cars={object_counts['car']}, Motor={object_counts['motor']}, Truck={object_counts['truck']}")
-                
-            else:
-                messagebox.showwarning("Warning", "YOLO model not loaded!")
-            
         except Exception as e:
             messagebox.showerror("Detection Error", f"Failed to process image: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            return
+        
+        # Perform object detection, usually already started by the enhancement page
+        error = registry.error(self.weights)
+        if error is None:
+            self.start_detection(enhanced_image)
+        else:
+            messagebox.showwarning("Warning", f"YOLO model not loaded! {str(error)}")
+
+    def on_detection_done(self, result):
+        self.hide_progress()
+        self.detected_image, object_counts = result
+        
+        # Calculate total
+        total_objects = sum(object_counts.values())
+        
+        # Update detection counts with proper formatting
+        self.total_label.configure(text=f"Number of objects detected: {total_objects}")
+        self.bus_label.configure(text=f"Bus: {object_counts['bus']}")
+        self.cars_label.configure(text=f"Cars: {object_counts['car']}")
+        self.motor_label.configure(text=f"Motor: {object_counts['motor']}")
+        self.truck_label.configure(text=f"Truck: {object_counts['truck']}")
+        
+        # Display Detection Image
+        self.detected_tk_image = self.detected_image.photo_image()
+        self.detected_label.configure(image=self.detected_tk_image)
+        self.detected_label.image = self.detected_tk_image
+        
+        # Print to console for debugging
+        print(f"Detection Results: Total={total_objects}, Bus={object_counts['bus']}, Cars={object_counts['car']}, Motor={object_counts['motor']}, Truck={object_counts['truck']}")
+
+    def on_detection_error(self, error):
+        self.hide_progress()
+        self.detection_source = None
+        messagebox.showerror("Detection Error", f"Failed to process image: {str(error)}")
+        import traceback
+        traceback.print_exception(error)
 
 
 # --- Main Execution ---
+def report_first_paint(app, exit_after):
+    # Runs once the start page has been drawn
+    app.update_idletasks()
+    print(f"Startup: first paint after {time.perf_counter() - STARTUP_TIME:.3f}s")
+    if exit_after:
+        app.destroy()
+        return
+    # Load and warm up the model now that the window is visible
+    registry.load_async(app.weights)
+
+
 if __name__ == "__main__":
-    app = ImageApp()
+    parser = argparse.ArgumentParser(description="Image Enhancement with Object Detection Prototype")
+    parser.add_argument("--startup-time", action="store_true", help="print the time to first paint and exit")
+    parser.add_argument("--trace", metavar="PATH", help="record per-stage timings; F12 dumps them to PATH")
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS, help=WEIGHTS_HELP)
+    args = parser.parse_args()
+    enable_from_args(args.trace)
+    trace_path = args.trace or os.environ.get(TRACE_ENV)
+
+    app = ImageApp(weights=args.weights)
+    if tracer.enabled:
+        app.bind("<F12>", lambda event: tracer.dump(trace_path))
+    app.after_idle(report_first_paint, app, args.startup_time)
     app.mainloop()
\ No newline at end of file
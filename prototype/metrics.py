@@ -1,11 +1,22 @@
 import numpy as np
 import cv2
 import math
+from typing import NamedTuple, Optional
+
+from tracing import span, traced
+
+# MetricsEngine sums integer histogram counts while Metrics sums the float32
+# output of cv2.calcHist, so entropies can differ by float32 rounding.
+# Across 720p-4K frames the differences stay below these bounds;
+# `python benchmark.py parity` checks them.
+ENTROPY_TOLERANCE = 1e-4
+CII_RELATIVE_TOLERANCE = 1e-9
 
 class Metrics:
     def __init__(self):
         pass
 
+    @traced("metrics.entropy")
     def calculate_entropy(self, image: np.ndarray) -> float:
         if image is None:
             return 0.0
@@ -19,6 +30,7 @@ class Metrics:
 
         return -sum([p * math.log(p, 2) for p in samples_probability])
 
+    @traced("metrics.cii")
     def calculate_cii(self, original_image: np.ndarray, enhanced_image: np.ndarray) -> float:
         if original_image is None or enhanced_image is None:
             return 0.0
@@ -32,6 +44,70 @@ class Metrics:
 
         return cii
 
+class PairMetrics(NamedTuple):
+    entropy_original: np.ndarray
+    entropy_enhanced: np.ndarray
+    cii: np.ndarray
+    mean_original: np.ndarray
+    mean_enhanced: np.ndarray
+    std_original: np.ndarray
+    std_enhanced: np.ndarray
+    hist_original: np.ndarray
+    hist_enhanced: np.ndarray
+
+
+class MetricsEngine:
+    # Computes entropy, mean, std and CII for (original, enhanced) grayscale
+    # pairs from one 256-bin histogram per image. Accepts single H x W images
+    # (results are scalars) or N x H x W stacks (results are length-N arrays).
+
+    def histogram(self, image: np.ndarray) -> np.ndarray:
+        if image.ndim == 2:
+            # calcHist counts in float32, exact up to 2**24 pixels per bin
+            return cv2.calcHist([image], [0], None, [256], [0, 256]).ravel().astype(np.int64)
+        return np.stack([self.histogram(frame) for frame in image])
+
+    def entropy(self, hist: np.ndarray) -> np.ndarray:
+        hist = np.asarray(hist, dtype=np.float64)
+        total = hist.sum(axis=-1, keepdims=True)
+        p = np.divide(hist, total, out=np.zeros_like(hist), where=total > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terms = np.where(p > 0, p * np.log2(p), 0.0)
+        return -terms.sum(axis=-1)
+
+    def mean_std(self, hist: np.ndarray):
+        hist = np.asarray(hist, dtype=np.float64)
+        levels = np.arange(256, dtype=np.float64)
+        total = hist.sum(axis=-1)
+        mean = (hist @ levels) / total
+        variance = (hist @ (levels * levels)) / total - mean * mean
+        return mean, np.sqrt(np.maximum(variance, 0.0))
+
+    def evaluate(self, original: np.ndarray, enhanced: np.ndarray,
+                 hist_original: Optional[np.ndarray] = None,
+                 hist_enhanced: Optional[np.ndarray] = None) -> PairMetrics:
+        with span("metrics.histogram"):
+            if hist_original is None:
+                hist_original = self.histogram(original)
+            if hist_enhanced is None:
+                hist_enhanced = self.histogram(enhanced)
+
+        # Both images go through the same vectorized pass
+        with span("metrics.stats"):
+            hists = np.stack([hist_original, hist_enhanced])
+            entropy = self.entropy(hists)
+            mean, std = self.mean_std(hists)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cii = np.where(std[0] == 0, np.inf, std[1] / std[0])
+
+        single = np.ndim(hist_original) == 1
+        values = [entropy[0], entropy[1], cii, mean[0], mean[1], std[0], std[1]]
+        if single:
+            values = [float(v) for v in values]
+        return PairMetrics(*values, hist_original, hist_enhanced)
+
+
 if __name__ == '__main__':
     metrics_calculator = Metrics()
     
@@ -0,0 +1,74 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+DEFAULT_WEIGHTS = 'best.pt'
+
+# Size of the blank frame used to warm up a freshly loaded model
+WARMUP_SIZE = (640, 640)
+WARMUP_RUNS = 1
+
+
+class ModelRegistry:
+    # Loads each YOLO weights file once, in the background, and shares the
+    # instance between the GUI pages and the command line tools. ultralytics
+    # (and torch) or onnxruntime are only imported when the first model of
+    # that kind is requested (see backends.load_model).
+    def __init__(self, warmup_size=WARMUP_SIZE, warmup_runs=WARMUP_RUNS):
+        self.warmup_size = warmup_size
+        self.warmup_runs = warmup_runs
+        self.timings = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def load_async(self, weights=DEFAULT_WEIGHTS):
+        with self._lock:
+            future = self._futures.get(weights)
+            if future is None:
+                future = Future()
+                self._futures[weights] = future
+                threading.Thread(target=self._load, args=(weights, future),
+                                 name=f"load-{weights}", daemon=True).start()
+        return future
+
+    def get(self, weights=DEFAULT_WEIGHTS, timeout=None):
+        return self.load_async(weights).result(timeout)
+
+    def ready(self, weights=DEFAULT_WEIGHTS):
+        future = self._futures.get(weights)
+        return future is not None and future.done() and future.exception() is None
+
+    def error(self, weights=DEFAULT_WEIGHTS):
+        future = self._futures.get(weights)
+        if future is None or not future.done():
+            return None
+        return future.exception()
+
+    def _load(self, weights, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            start = time.perf_counter()
+            from backends import load_model
+            model = load_model(weights)
+            loaded = time.perf_counter()
+
+            # The first inference allocates buffers and picks kernels; do it
+            # now rather than on the user's first image.
+            if self.warmup_runs:
+                blank = np.zeros((self.warmup_size[0], self.warmup_size[1], 3), dtype=np.uint8)
+                for _ in range(self.warmup_runs):
+                    model(blank, verbose=False)
+            self.timings[weights] = {
+                "load_seconds": loaded - start,
+                "warmup_seconds": time.perf_counter() - loaded,
+            }
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(model)
+
+
+registry = ModelRegistry()
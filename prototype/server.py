@@ -0,0 +1,363 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy as np
+
+from backends import WEIGHTS_HELP, load_detector
+from detection import CONF_THRESHOLD, BatchDetectionService, StubDetector, count_objects
+from enhancement import GAMMA_MODES, Enhancer
+from metrics import MetricsEngine
+from models import DEFAULT_WEIGHTS
+
+MAX_BODY_BYTES = 64 * 1024 ** 2
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           411: "Length Required", 413: "Payload Too Large", 429: "Too Many Requests",
+           500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.status = status
+        self.message = message or REASONS.get(status, "")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def exposition(self, name, labels=""):
+        sep = "," if labels else ""
+        lines = [f'{name}_bucket{{{labels}{sep}le="{bound}"}} {count}'
+                 for bound, count in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class ServerMetrics:
+    # Counters in the Prometheus text format, served at GET /metrics
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.batch_size = Histogram(BATCH_BUCKETS)
+        self.in_flight = 0
+        self.started = time.time()
+
+    def observe(self, endpoint, status, seconds):
+        self.requests[(endpoint, status)] += 1
+        self.latency[endpoint].observe(seconds)
+
+    def exposition(self):
+        lines = [
+            "# HELP prototype_requests_total Requests by endpoint and status.",
+            "# TYPE prototype_requests_total counter",
+        ]
+        for (endpoint, status), count in sorted(self.requests.items()):
+            lines.append(f'prototype_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+        lines += [
+            "# HELP prototype_request_seconds Request latency.",
+            "# TYPE prototype_request_seconds histogram",
+        ]
+        for endpoint, histogram in sorted(self.latency.items()):
+            lines += histogram.exposition("prototype_request_seconds", f'endpoint="{endpoint}"')
+        lines += [
+            "# HELP prototype_detect_batch_size Frames per detector call.",
+            "# TYPE prototype_detect_batch_size histogram",
+        ]
+        lines += self.batch_size.exposition("prototype_detect_batch_size")
+        lines += [
+            "# HELP prototype_in_flight Requests being processed or queued.",
+            "# TYPE prototype_in_flight gauge",
+            f"prototype_in_flight {self.in_flight}",
+            "# HELP prototype_uptime_seconds Seconds since the server started.",
+            "# TYPE prototype_uptime_seconds gauge",
+            f"prototype_uptime_seconds {time.time() - self.started:.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class InferenceServer:
+    def __init__(self, enhancer, detector, max_queue=64, workers=None, max_batch_size=8, max_wait=0.01):
+        self.enhancer = enhancer
+        self.detector = detector
+        self.metrics_engine = MetricsEngine()
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.stats = ServerMetrics()
+        # Concurrent detect requests are grouped into one detector call on
+        # the service's own thread, so batches never wait behind enhancement
+        self.batcher = BatchDetectionService(self._detect_batch, max_batch_size, max_wait)
+        self.loop = None
+        self.routes = {
+            ("POST", "/v1/enhance"): self.enhance,
+            ("POST", "/v1/metrics"): self.image_metrics,
+            ("POST", "/v1/detect"): self.detect,
+            ("GET", "/metrics"): self.prometheus,
+            ("GET", "/healthz"): self.health,
+        }
+
+    async def start(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self):
+        self.batcher.close()
+        self.executor.shutdown()
+
+    # --- HTTP ---
+
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive: serve requests until the client closes
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HttpError as e:
+                    await self.write_response(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, payload, extra_headers = await self.dispatch(method, path, query, headers, body)
+                await self.write_response(writer, status, payload, extra_headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        try:
+            line = await reader.readline()
+        except ValueError:
+            raise HttpError(400, "request line too long")
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = b""
+        if "transfer-encoding" in headers:
+            raise HttpError(411, "chunked bodies are not supported, send Content-Length")
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HttpError(400, "invalid Content-Length")
+        if length < 0:
+            raise HttpError(400, "invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413)
+        if length:
+            body = await reader.readexactly(length)
+        url = urlsplit(target)
+        return method.upper(), url.path, parse_qs(url.query), headers, body
+
+    async def write_response(self, writer, status, payload, extra_headers=None, keep_alive=True):
+        if isinstance(payload, bytes):
+            body, content_type = payload, "application/octet-stream"
+        elif isinstance(payload, tuple):
+            body, content_type = payload
+        elif isinstance(payload, str):
+            body, content_type = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload).encode(), "application/json"
+        headers = {
+            "Content-Type": content_type,
+            "Content-Length": str(len(body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+            **(extra_headers or {}),
+        }
+        head = f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        await writer.drain()
+
+    async def dispatch(self, method, path, query, headers, body):
+        start = time.perf_counter()
+        handler = self.routes.get((method, path))
+        endpoint = path if handler else "other"
+        extra_headers = {}
+        try:
+            if handler is None:
+                allowed = any(route_path == path for _, route_path in self.routes)
+                raise HttpError(405 if allowed else 404)
+            if method == "POST":
+                # Admission control: shed load instead of queueing without bound
+                if self.stats.in_flight >= self.max_queue:
+                    extra_headers["Retry-After"] = "1"
+                    raise HttpError(429, "server busy, retry later")
+                self.stats.in_flight += 1
+                try:
+                    payload = await handler(query, headers, body)
+                finally:
+                    self.stats.in_flight -= 1
+            else:
+                payload = await handler(query, headers, body)
+            status = 200
+        except HttpError as e:
+            status, payload = e.status, {"error": e.message}
+        except Exception as e:
+            status, payload = 500, {"error": str(e)}
+        self.stats.observe(endpoint, status, time.perf_counter() - start)
+        return status, payload, extra_headers
+
+    # --- Endpoints ---
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    @staticmethod
+    def decode(headers, body):
+        # Encoded images (PNG, JPEG, ...) or raw BGR pixels with the size in
+        # X-Width / X-Height headers and Content-Type application/x-raw-bgr
+        if not body:
+            raise HttpError(400, "empty body")
+        if headers.get("content-type", "") == "application/x-raw-bgr":
+            try:
+                width, height = int(headers["x-width"]), int(headers["x-height"])
+            except (KeyError, ValueError):
+                raise HttpError(400, "raw images need X-Width and X-Height headers")
+            if len(body) != width * height * 3:
+                raise HttpError(400, "raw body does not match X-Width x X-Height x 3")
+            return np.frombuffer(body, dtype=np.uint8).reshape(height, width, 3)
+        image = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise HttpError(400, "could not decode image")
+        return image
+
+    @staticmethod
+    def encode(image, fmt):
+        if fmt == "raw":
+            return np.ascontiguousarray(image).tobytes(), "application/x-raw-bgr"
+        ext = ".jpg" if fmt in ("jpg", "jpeg") else ".png"
+        ok, data = cv2.imencode(ext, image)
+        if not ok:
+            raise HttpError(500, "could not encode image")
+        return data.tobytes(), "image/jpeg" if ext == ".jpg" else "image/png"
+
+    def _enhance(self, headers, body, fmt):
+        enhanced = self.enhancer.enhance(self.decode(headers, body))
+        return self.encode(enhanced, fmt)
+
+    async def enhance(self, query, headers, body):
+        fmt = query.get("format", ["png"])[0]
+        return await self.run(self._enhance, headers, body, fmt)
+
+    def _metrics(self, headers, body):
+        image = self.decode(headers, body)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        _, enhanced_gray = self.enhancer.enhance_fused(image)
+        metrics = self.metrics_engine.evaluate(gray, enhanced_gray)
+        return {
+            "entropy_original": metrics.entropy_original,
+            "entropy_enhanced": metrics.entropy_enhanced,
+            # CII is infinite for a flat original, which JSON cannot represent
+            "cii": metrics.cii if np.isfinite(metrics.cii) else None,
+        }
+
+    def _detect_batch(self, frames):
+        # Runs on the batcher thread; the counters belong to the event loop
+        self.loop.call_soon_threadsafe(self.stats.batch_size.observe, len(frames))
+        return self.detector(frames)
+
+    async def image_metrics(self, query, headers, body):
+        return await self.run(self._metrics, headers, body)
+
+    async def detect(self, query, headers, body):
+        image = await self.run(self.decode, headers, body)
+        if query.get("enhance", ["0"])[0] in ("1", "true"):
+            image = await self.run(self.enhancer.enhance, image)
+        detections = await asyncio.wrap_future(self.batcher.submit(image))
+        return {
+            "boxes": detections.boxes.round(2).tolist(),
+            "confidences": detections.confidences.round(4).tolist(),
+            "classes": [detections.names.get(int(cls), str(cls)) for cls in detections.class_ids],
+            "counts": count_objects(detections),
+        }
+
+    async def prometheus(self, query, headers, body):
+        return self.stats.exposition()
+
+    async def health(self, query, headers, body):
+        return {"status": "ok"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP service for enhancement, metrics and detection.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS, help=WEIGHTS_HELP)
+    parser.add_argument("--conf", type=float, default=CONF_THRESHOLD)
+    parser.add_argument("--stub-detector", action="store_true", help="use a fake detector instead of YOLO")
+    parser.add_argument("--stub-delay", type=float, default=0.005, help="simulated inference seconds per frame")
+    parser.add_argument("--max-queue", type=int, default=64, help="requests in flight before answering 429")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait", type=float, default=0.01, help="seconds to wait for a detect batch to fill")
+    parser.add_argument("--workers", type=int, default=None, help="threads for decoding and enhancement")
+    parser.add_argument("--gamma-mode", choices=GAMMA_MODES, default="content")
+    parser.add_argument("--gamma", type=float, default=0.75)
+    args = parser.parse_args(argv)
+
+    if args.stub_detector:
+        detector = StubDetector(call_delay=0.02, frame_delay=args.stub_delay, conf=args.conf)
+    else:
+        detector = load_detector(args.weights, conf=args.conf)
+
+    server = InferenceServer(
+        Enhancer(gamma_mode=args.gamma_mode, gamma=args.gamma),
+        detector,
+        max_queue=args.max_queue,
+        workers=args.workers,
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait,
+    )
+
+    async def serve():
+        listener = await server.start(args.host, args.port)
+        print(f"Listening on http://{args.host}:{args.port}")
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,371 @@
+import argparse
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from backends import WEIGHTS_HELP, load_detector
+from detection import CONF_THRESHOLD, StubDetector, draw_detections
+from enhancement import GAMMA_MODES, Enhancer, VideoEnhancer
+from governor import QualityGovernor
+from models import DEFAULT_WEIGHTS
+from tracing import enable_from_args, span
+from tracking import PROPAGATION_MODES, KeyframeDetector
+
+BACKPRESSURE_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+# Marks the end of the stream, never dropped
+_END = object()
+# How often a blocked put or get checks whether the pipeline was stopped
+_POLL_SECONDS = 0.1
+
+
+class StageStats:
+    def __init__(self, name, window=1000):
+        self.name = name
+        self.latencies = deque(maxlen=window)
+        self.processed = 0
+        self.dropped = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            now = time.perf_counter()
+            if self.started is None:
+                self.started = now - seconds
+            self.finished = now
+            self.processed += 1
+            self.latencies.append(seconds)
+
+    def record_drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    @property
+    def fps(self):
+        if self.started is None or self.finished <= self.started:
+            return 0.0
+        return self.processed / (self.finished - self.started)
+
+    def percentiles(self, q=(50, 95, 99)):
+        with self._lock:
+            latencies = np.array(self.latencies, dtype=np.float64)
+        if latencies.size == 0:
+            return {p: 0.0 for p in q}
+        return dict(zip(q, np.percentile(latencies, q) * 1000))
+
+    def summary(self):
+        p = self.percentiles()
+        return (f"{self.name:<8} {self.processed:>6} frames {self.fps:>8.2f} fps  "
+                f"p50 {p[50]:>7.2f} ms  p95 {p[95]:>7.2f} ms  p99 {p[99]:>7.2f} ms  dropped {self.dropped}")
+
+
+class StageQueue:
+    # A bounded queue between two stages. When it is full, `block` waits for
+    # the consumer, `drop_oldest` discards the stalest queued frame and
+    # `drop_newest` discards the frame being put. Once `stop` is set nothing
+    # waits any more: puts into a full queue are discarded and a get from an
+    # empty queue returns _END, so every stage can exit even when the stage
+    # after it died.
+    def __init__(self, maxsize, policy, stats, stop=None):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy!r}, expected one of {BACKPRESSURE_POLICIES}")
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.policy = policy
+        self.stats = stats
+        self.stop = stop or threading.Event()
+
+    def _put_blocking(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def put(self, item):
+        if item is _END or self.policy == "block":
+            self._put_blocking(item)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                if self.policy == "drop_newest":
+                    self.stats.record_drop()
+                    return
+            try:
+                dropped = self.queue.get_nowait()
+            except queue.Empty:
+                continue
+            if dropped is _END:
+                self._put_blocking(dropped)
+                return
+            self.stats.record_drop()
+
+    def get(self):
+        while True:
+            try:
+                return self.queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                if self.stop.is_set():
+                    return _END
+
+
+class VideoSource:
+    # Frames from a video file, camera index or stream URL (rtsp://, http://)
+    def __init__(self, location):
+        self.location = location
+
+    @property
+    def live(self):
+        # Cameras and streams run in real time; a file can be read as
+        # slowly as the pipeline needs
+        return isinstance(self.location, int) or "://" in str(self.location)
+
+    def __iter__(self):
+        capture = cv2.VideoCapture(self.location)
+        if not capture.isOpened():
+            raise IOError(f"Could not open video source {self.location}")
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield frame
+        finally:
+            capture.release()
+
+    def fps(self, default=25.0):
+        capture = cv2.VideoCapture(self.location)
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        capture.release()
+        return fps if fps and fps > 0 else default
+
+
+class VideoWriterSink:
+    def __init__(self, path, fps=25.0, fourcc="mp4v"):
+        self.path = path
+        self.fps = fps
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.writer = None
+        self.size = None
+
+    def __call__(self, index, frame, detections):
+        if self.writer is None:
+            height, width = frame.shape[:2]
+            self.size = (width, height)
+            self.writer = cv2.VideoWriter(self.path, self.fourcc, self.fps, self.size)
+        # A video has one size; frames downscaled by the governor are scaled back
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_LINEAR)
+        self.writer.write(frame)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+class StreamPipeline:
+    # decode -> enhance -> detect -> annotate/sink, one thread per stage with
+    # bounded queues in between. `detector` takes a list of frames and returns
+    # a list of Detections; `sink` is called with (index, annotated frame, detections).
+    # With a `governor`, stage latencies drive its quality tier, which sets
+    # the input scale, the enhancer and the detection size (or, for
+    # static-shape models, the keyframe interval).
+    def __init__(self, source, enhancer, detector, sink=None, queue_size=8,
+                 policy="drop_oldest", annotate=True, governor=None):
+        self.source = source
+        self.enhancer = enhancer
+        self.detector = detector
+        self.sink = sink
+        self.annotate = annotate
+        self.governor = governor
+        self.stats = {name: StageStats(name) for name in ("decode", "enhance", "detect", "sink")}
+        # Drops are counted against the stage that could not keep up. Frames
+        # are only dropped going into the expensive stages; the sink queue
+        # always blocks so that every detected frame is delivered.
+        self._stop = threading.Event()
+        self._errors = []
+        self.queues = {
+            "enhance": StageQueue(queue_size, policy, self.stats["enhance"], self._stop),
+            "detect": StageQueue(queue_size, policy, self.stats["detect"], self._stop),
+            "sink": StageQueue(queue_size, "block", self.stats["sink"], self._stop),
+        }
+
+    def stop(self):
+        self._stop.set()
+
+    def _decode(self):
+        stats = self.stats["decode"]
+        out = self.queues["enhance"]
+        frames = iter(self.source)
+        index = 0
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                frame = next(frames, None)
+                if frame is None:
+                    break
+                stats.record(time.perf_counter() - start)
+                out.put((index, frame, None))
+                index += 1
+        finally:
+            out.put(_END)
+
+    def _worker(self, name, next_name, process):
+        stats = self.stats[name]
+        inbox = self.queues[name]
+        out = self.queues.get(next_name)
+        while True:
+            item = inbox.get()
+            if item is _END:
+                if out is not None:
+                    out.put(_END)
+                return
+            if self._stop.is_set():
+                continue
+            start = time.perf_counter()
+            result = process(*item)
+            elapsed = time.perf_counter() - start
+            stats.record(elapsed)
+            if self.governor is not None:
+                self.governor.observe(name, elapsed)
+            if out is not None:
+                out.put(result)
+
+    def _enhance(self, index, frame, detections):
+        if self.governor is not None:
+            return index, self.governor.enhance(frame), detections
+        return index, self.enhancer.enhance(frame), detections
+
+    def _detect(self, index, frame, detections):
+        if self.governor is not None:
+            self.governor.configure(self.detector)
+        with span("stream.detect"):
+            return index, frame, self.detector([frame])[0]
+
+    def _sink(self, index, frame, detections):
+        if self.annotate:
+            with span("stream.annotate"):
+                draw_detections(frame, detections)
+        if self.sink is not None:
+            with span("stream.sink"):
+                self.sink(index, frame, detections)
+
+    def _guard(self, target, *args):
+        try:
+            target(*args)
+        except BaseException as e:
+            self._errors.append(e)
+            # The other stages stop waiting on their queues and exit, and
+            # run() re-raises the first error
+            self._stop.set()
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self._guard, args=(self._decode,), name="decode"),
+            threading.Thread(target=self._guard, args=(self._worker, "enhance", "detect", self._enhance), name="enhance"),
+            threading.Thread(target=self._guard, args=(self._worker, "detect", "sink", self._detect), name="detect"),
+            threading.Thread(target=self._guard, args=(self._worker, "sink", None, self._sink), name="sink"),
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+        return self.stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Enhance and detect vehicles in a video file or stream.")
+    parser.add_argument("source", help="video file, camera index or stream URL")
+    parser.add_argument("-o", "--output", help="write the annotated video here")
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS, help=WEIGHTS_HELP)
+    parser.add_argument("--conf", type=float, default=CONF_THRESHOLD)
+    parser.add_argument("--stub-detector", action="store_true", help="use a fake detector instead of YOLO")
+    parser.add_argument("--stub-delay", type=float, default=0.02, help="simulated inference seconds per frame")
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--policy", choices=BACKPRESSURE_POLICIES,
+                        help="what a full queue does (default: block for files, so no frame is lost, "
+                        "drop_oldest for cameras and streams)")
+    parser.add_argument("--gamma-mode", choices=GAMMA_MODES, default="fixed")
+    parser.add_argument("--gamma", type=float, default=0.75)
+    parser.add_argument("--temporal", action="store_true",
+                        help="smooth gamma across frames and reuse the output for near-static frames")
+    parser.add_argument("--keyframe-interval", type=int,
+                        help="run detection every N frames and track boxes in between")
+    parser.add_argument("--motion-threshold", type=float,
+                        help="also detect when the mean luma change since the last keyframe exceeds this")
+    parser.add_argument("--propagation", choices=PROPAGATION_MODES, default="flow")
+    parser.add_argument("--deadline-ms", type=float,
+                        help="per-frame budget; step through quality tiers to stay within it")
+    parser.add_argument("--trace", metavar="PATH", help="write a Chrome trace of every stage to PATH; "
+                        "SIGUSR1 prints per-stage timings while running")
+    args = parser.parse_args(argv)
+    enable_from_args(args.trace)
+
+    location = int(args.source) if args.source.isdigit() else args.source
+    source = VideoSource(location)
+    policy = args.policy or ("drop_oldest" if source.live else "block")
+
+    if args.stub_detector:
+        detector = StubDetector(frame_delay=args.stub_delay, conf=args.conf)
+    else:
+        detector = load_detector(args.weights, conf=args.conf)
+    if args.keyframe_interval:
+        detector = KeyframeDetector(detector, interval=args.keyframe_interval,
+                                    motion_threshold=args.motion_threshold, propagation=args.propagation)
+
+    if args.temporal:
+        enhancer = VideoEnhancer(gamma_mode=args.gamma_mode, gamma=args.gamma)
+    else:
+        enhancer = Enhancer(gamma_mode=args.gamma_mode, gamma=args.gamma)
+
+    governor = QualityGovernor(args.deadline_ms / 1000, enhancer) if args.deadline_ms else None
+
+    sink = VideoWriterSink(args.output, fps=source.fps()) if args.output else None
+    pipeline = StreamPipeline(
+        source,
+        enhancer,
+        detector,
+        sink=sink,
+        queue_size=args.queue_size,
+        policy=policy,
+        governor=governor,
+    )
+    try:
+        stats = pipeline.run()
+    except KeyboardInterrupt:
+        pipeline.stop()
+        return 130
+    finally:
+        if sink is not None:
+            sink.close()
+
+    for stage in stats.values():
+        print(stage.summary())
+    if args.temporal:
+        # The governor runs copies of the enhancer, one per tile grid
+        enhancers = list(governor.enhancers.values()) if governor is not None else [enhancer]
+        print(f"enhance: reused {sum(e.reused for e in enhancers)}/{sum(e.frames for e in enhancers)} frames, "
+              f"{sum(e.scene_changes for e in enhancers)} scene changes")
+    if governor is not None:
+        print(f"governor: ended at tier {governor.tier.name}, {len(governor.changes)} changes, "
+              f"enhancement skipped on {governor.skipped} frames")
+    if args.keyframe_interval:
+        print(f"detect: {detector.keyframes}/{detector.frames} keyframes, unique tracks {detector.counts()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+import numpy as np
+import cv2
+
+CONDITIONS = ("lowlight", "fog")
+
+# A few vehicle-like colours (BGR)
+VEHICLE_COLOURS = np.array([
+    (40, 40, 200), (200, 200, 200), (30, 30, 30), (180, 120, 40), (60, 160, 220),
+], dtype=np.uint8)
+
+
+def road_scene(height, width, rng):
+    # Sky gradient over a grey road with lane markings and box-shaped vehicles
+    scene = np.empty((height, width, 3), dtype=np.uint8)
+    horizon = height // 3
+    sky = np.linspace(230, 150, horizon, dtype=np.float32)[:, None, None]
+    scene[:horizon] = (sky * np.array([1.0, 0.9, 0.8], dtype=np.float32)).astype(np.uint8)
+    scene[horizon:] = 90
+    for lane in range(1, 4):
+        x = int(width * lane / 4)
+        cv2.line(scene, (width // 2, horizon), (x * 2 - width // 2, height), (220, 220, 220), max(2, width // 400))
+    for _ in range(12):
+        y = int(rng.integers(horizon, height - 10))
+        # Vehicles further away (closer to the horizon) are smaller
+        scale = (y - horizon) / (height - horizon) + 0.1
+        w = int(width * 0.08 * scale) + 4
+        h = int(w * 0.6) + 2
+        x = int(rng.integers(0, max(1, width - w)))
+        colour = VEHICLE_COLOURS[rng.integers(len(VEHICLE_COLOURS))].tolist()
+        cv2.rectangle(scene, (x, y - h), (x + w, y), colour, -1)
+    return scene
+
+
+def synthetic_frame(height, width, condition="lowlight", seed=0):
+    rng = np.random.default_rng(seed)
+    scene = road_scene(height, width, rng).astype(np.float32)
+    if condition == "lowlight":
+        # Dark, slightly blue and noisy, like a night-time sensor
+        scene = scene * 0.18 * np.array([1.1, 0.9, 0.8], dtype=np.float32)
+        scene += rng.normal(0, 4, size=scene.shape).astype(np.float32)
+    elif condition == "fog":
+        # Haze that thickens towards the horizon and flattens contrast
+        depth = np.linspace(0.75, 0.3, height, dtype=np.float32)[:, None, None]
+        scene = scene * (1 - depth) + 200 * depth
+        scene += rng.normal(0, 2, size=scene.shape).astype(np.float32)
+    else:
+        raise ValueError(f"Unknown condition {condition!r}, expected one of {CONDITIONS}")
+    return np.clip(scene, 0, 255).astype(np.uint8)
@@ -0,0 +1,28 @@
+import numpy as np
+from PIL import Image
+
+from frames import Frame, pil_to_cv2
+
+# EXIF orientation tag; 6 means "rotate 90 degrees clockwise to display"
+ORIENTATION = 0x0112
+
+
+def write_rotated_jpeg(path):
+    # A wide image whose EXIF says it should be shown rotated
+    rgb = np.zeros((40, 80, 3), dtype=np.uint8)
+    rgb[:, :40] = (255, 0, 0)
+    exif = Image.Exif()
+    exif[ORIENTATION] = 6
+    Image.fromarray(rgb).save(path, exif=exif, quality=95)
+
+
+def test_from_path_ignores_exif_orientation(tmp_path):
+    path = str(tmp_path / "rotated.jpg")
+    write_rotated_jpeg(path)
+    frame = Frame.from_path(path)
+    with Image.open(path) as pil_image:
+        # How the GUI loaded images before Frame
+        expected = pil_to_cv2(pil_image)
+    assert frame.shape == (40, 80, 3)
+    assert frame.shape == expected.shape
+    assert np.abs(frame.bgr.astype(np.int16) - expected).max() <= 2
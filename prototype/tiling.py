@@ -0,0 +1,259 @@
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from backends import WEIGHTS_HELP, load_detector
+from detection import CONF_THRESHOLD, Detections, StubDetector, count_objects, draw_detections, empty_detections
+from enhancement import GAMMA_MODES, Enhancer
+from models import DEFAULT_WEIGHTS
+
+TILE_SIZE = 1280
+TILE_OVERLAP = 160
+NMS_IOU_THRESHOLD = 0.5
+# Boxes cut by a tile seam mostly lie inside the full box from the
+# neighbouring tile; they are merged when this much of the smaller box overlaps.
+NMS_IOS_THRESHOLD = 0.8
+# Pixels outside the ROI polygons are painted this grey, the letterbox
+# padding colour, before detection
+MASK_FILL = 114
+
+
+def axis_tiles(length, tile_size, overlap):
+    # Start/end of each tile along one axis plus the part of the tile
+    # (its core) that it owns in a stitched output.
+    if length <= tile_size:
+        return [(0, length, 0, length)]
+    stride = tile_size - overlap
+    starts = list(range(0, length - tile_size, stride)) + [length - tile_size]
+    ends = [start + tile_size for start in starts]
+    cores = [0] + [(ends[i] + starts[i + 1]) // 2 for i in range(len(starts) - 1)] + [length]
+    return [(starts[i], ends[i], cores[i], cores[i + 1]) for i in range(len(starts))]
+
+
+def tile_grid(height, width, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    # Each tile is (x0, y0, x1, y1, core) where core is the (x0, y0, x1, y1)
+    # region of the image that this tile writes when stitching.
+    tiles = []
+    for y0, y1, cy0, cy1 in axis_tiles(height, tile_size, overlap):
+        for x0, x1, cx0, cx1 in axis_tiles(width, tile_size, overlap):
+            tiles.append((x0, y0, x1, y1, (cx0, cy0, cx1, cy1)))
+    return tiles
+
+
+def clip_tile(tile, mask):
+    # Shrinks a tile to the bounding rectangle of the ROI pixels inside it.
+    # None when it has none, or when they all lie in the overlap, which the
+    # neighbouring tile owns and covers as well.
+    x0, y0, x1, y1, (cx0, cy0, cx1, cy1) = tile
+    x, y, w, h = cv2.boundingRect(mask[y0:y1, x0:x1])
+    x0, y0, x1, y1 = x0 + x, y0 + y, x0 + x + w, y0 + y + h
+    core = (max(cx0, x0), max(cy0, y0), min(cx1, x1), min(cy1, y1))
+    if core[2] <= core[0] or core[3] <= core[1]:
+        return None
+    return x0, y0, x1, y1, core
+
+
+def polygons_mask(shape, polygons):
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+    for polygon in polygons:
+        cv2.fillPoly(mask, [np.asarray(polygon, dtype=np.int32)], 255)
+    return mask
+
+
+def parse_polygon(text):
+    # "x,y x,y x,y ..." -> N x 2 array
+    return np.array([[float(v) for v in point.split(",")] for point in text.split()], dtype=np.float32)
+
+
+def box_overlaps(box, boxes):
+    # IoU and intersection over the smaller box between one box and many
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    iou = intersection / np.maximum(area + areas - intersection, 1e-9)
+    ios = intersection / np.maximum(np.minimum(area, areas), 1e-9)
+    return iou, ios
+
+
+def nms(detections, iou_threshold=NMS_IOU_THRESHOLD, ios_threshold=NMS_IOS_THRESHOLD):
+    # Greedy per-class suppression, highest confidence first
+    if len(detections.boxes) == 0:
+        return detections
+    keep = []
+    for cls in np.unique(detections.class_ids):
+        index = np.flatnonzero(detections.class_ids == cls)
+        index = index[np.argsort(-detections.confidences[index], kind="stable")]
+        while index.size:
+            best = index[0]
+            keep.append(best)
+            iou, ios = box_overlaps(detections.boxes[best], detections.boxes[index[1:]])
+            index = index[1:][(iou <= iou_threshold) & (ios <= ios_threshold)]
+    keep = np.array(sorted(keep, key=lambda i: -detections.confidences[i]), dtype=np.int64)
+    return Detections(detections.boxes[keep], detections.confidences[keep], detections.class_ids[keep], detections.names)
+
+
+def concat_detections(parts, names):
+    parts = [part for part in parts if len(part.boxes)]
+    if not parts:
+        return empty_detections(names)
+    return Detections(
+        np.concatenate([part.boxes for part in parts]),
+        np.concatenate([part.confidences for part in parts]),
+        np.concatenate([part.class_ids for part in parts]),
+        names,
+    )
+
+
+class TiledProcessor:
+    # Splits large frames into overlapping tiles, enhances and detects each
+    # tile and stitches the results. With ROI polygons each tile is cut down
+    # to the bounding rectangle of the polygons inside it, tiles without any
+    # are skipped, pixels outside the polygons are left exactly as they were
+    # and are blanked before detection, so the work scales with the ROI.
+    def __init__(self, enhancer=None, detector=None, tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                 rois=None, workers=None, iou_threshold=NMS_IOU_THRESHOLD, ios_threshold=NMS_IOS_THRESHOLD):
+        if overlap >= tile_size:
+            raise ValueError("overlap must be smaller than tile_size")
+        self.enhancer = enhancer or Enhancer()
+        self.detector = detector
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.rois = rois or []
+        self.iou_threshold = iou_threshold
+        self.ios_threshold = ios_threshold
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def plan(self, image):
+        # The tiles worth processing and the ROI mask (None without ROIs)
+        tiles = tile_grid(image.shape[0], image.shape[1], self.tile_size, self.overlap)
+        if not self.rois:
+            return tiles, None
+        mask = polygons_mask(image.shape, self.rois)
+        tiles = [clipped for clipped in (clip_tile(tile, mask) for tile in tiles) if clipped is not None]
+        return tiles, mask
+
+    def choose_gamma(self, image, mask):
+        # One gamma for the whole frame so tiles match at the seams
+        if mask is None:
+            return self.enhancer.choose_gamma(image)
+        x, y, w, h = cv2.boundingRect(mask)
+        return self.enhancer.choose_gamma(image[y:y + h, x:x + w])
+
+    def enhance(self, image, plan=None):
+        tiles, mask = plan or self.plan(image)
+        gamma = self.choose_gamma(image, mask)
+        output = image.copy()
+
+        def enhance_tile(tile):
+            x0, y0, x1, y1, (cx0, cy0, cx1, cy1) = tile
+            enhanced = self.enhancer.enhance(image[y0:y1, x0:x1], gamma=gamma)
+            # Only the core of each tile is written, the overlap gives CLAHE context
+            core = enhanced[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+            target = output[cy0:cy1, cx0:cx1]
+            if mask is None:
+                target[...] = core
+            else:
+                cv2.copyTo(core, mask[cy0:cy1, cx0:cx1], target)
+
+        list(self.executor.map(enhance_tile, tiles))
+        return output
+
+    @staticmethod
+    def mask_crop(crop, mask):
+        masked = np.full_like(crop, MASK_FILL)
+        cv2.copyTo(crop, mask, masked)
+        return masked
+
+    def detect(self, image, plan=None):
+        if self.detector is None:
+            raise ValueError("TiledProcessor has no detector")
+        tiles, mask = plan or self.plan(image)
+        crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1, _ in tiles]
+        if mask is not None:
+            crops = [self.mask_crop(crop, mask[y0:y1, x0:x1]) for crop, (x0, y0, x1, y1, _) in zip(crops, tiles)]
+        results = self.detector(crops) if crops else []
+
+        names = getattr(self.detector, "names", None) or {}
+        parts = []
+        for (x0, y0, _, _, _), detections in zip(tiles, results):
+            names = detections.names
+            offset = np.array([x0, y0, x0, y0], dtype=np.float32)
+            parts.append(detections._replace(boxes=detections.boxes + offset))
+        merged = concat_detections(parts, names)
+
+        if mask is not None and len(merged.boxes):
+            # Keep boxes whose centre falls inside a region of interest
+            cx = ((merged.boxes[:, 0] + merged.boxes[:, 2]) / 2).astype(int).clip(0, mask.shape[1] - 1)
+            cy = ((merged.boxes[:, 1] + merged.boxes[:, 3]) / 2).astype(int).clip(0, mask.shape[0] - 1)
+            inside = mask[cy, cx] > 0
+            merged = Detections(merged.boxes[inside], merged.confidences[inside], merged.class_ids[inside], names)
+        return nms(merged, self.iou_threshold, self.ios_threshold)
+
+    def process(self, image, plan=None):
+        plan = plan or self.plan(image)
+        enhanced = self.enhance(image, plan)
+        detections = self.detect(enhanced, plan) if self.detector is not None else None
+        return enhanced, detections
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiled enhancement and detection for large frames.")
+    parser.add_argument("image")
+    parser.add_argument("-o", "--output", help="write the enhanced and annotated image here")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE)
+    parser.add_argument("--overlap", type=int, default=TILE_OVERLAP)
+    parser.add_argument("--roi", action="append", default=[], metavar="'X,Y X,Y X,Y ...'",
+                        help="region of interest polygon, may be repeated")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS, help=WEIGHTS_HELP)
+    parser.add_argument("--conf", type=float, default=CONF_THRESHOLD)
+    parser.add_argument("--stub-detector", action="store_true", help="use a fake detector instead of YOLO")
+    parser.add_argument("--no-detect", action="store_true", help="only enhance")
+    parser.add_argument("--gamma-mode", choices=GAMMA_MODES, default="fixed")
+    parser.add_argument("--gamma", type=float, default=0.75)
+    args = parser.parse_args(argv)
+
+    image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+    if image is None:
+        parser.error(f"could not read {args.image}")
+
+    detector = None
+    if args.stub_detector:
+        detector = StubDetector(conf=args.conf)
+    elif not args.no_detect:
+        detector = load_detector(args.weights, conf=args.conf)
+
+    processor = TiledProcessor(
+        Enhancer(gamma_mode=args.gamma_mode, gamma=args.gamma),
+        detector,
+        tile_size=args.tile_size,
+        overlap=args.overlap,
+        rois=[parse_polygon(roi) for roi in args.roi],
+        workers=args.workers,
+    )
+    plan = processor.plan(image)
+    print(f"{len(plan[0])} tiles of up to {args.tile_size}px for a {image.shape[1]}x{image.shape[0]} image")
+    enhanced, detections = processor.process(image, plan)
+    processor.close()
+
+    if detections is not None:
+        counts = count_objects(detections)
+        print(f"Detection Results: Total={sum(counts.values())}, Bus={counts['bus']}, Cars={counts['car']}, Motor={counts['motor']}, Truck={counts['truck']}")
+        draw_detections(enhanced, detections)
+    if args.output:
+        cv2.imwrite(args.output, enhanced)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
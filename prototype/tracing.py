@@ -0,0 +1,177 @@
+import atexit
+import functools
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+# Set PROTOTYPE_TRACE=trace.json (or pass --trace) to trace the GUI or a
+# command line tool and write the Chrome trace (chrome://tracing,
+# ui.perfetto.dev) when it exits. Only the entry point enables tracing:
+# worker processes hand their events back to it (see drain and merge).
+TRACE_ENV = "PROTOTYPE_TRACE"
+MAX_EVENTS = 200000
+HISTOGRAM_WINDOW = 1000
+
+
+class _NullSpan:
+    # Returned while tracing is off: entering and leaving it does nothing
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter() - self.start, self.args)
+        return False
+
+
+class Tracer:
+    # Collects timed spans as Chrome trace events and, optionally, a rolling
+    # window of durations per span name. While disabled, span() returns a
+    # shared no-op object, so instrumented code pays one attribute check.
+    def __init__(self):
+        self.enabled = False
+        self.keep_events = True
+        self.keep_histograms = True
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.durations = defaultdict(lambda: deque(maxlen=self.window))
+        self.window = HISTOGRAM_WINDOW
+        # Timestamps are wall-clock microseconds so events merged from worker
+        # processes line up with the parent's; perf_counter gives the resolution
+        self._wall_offset = time.time() - time.perf_counter()
+        self._lock = threading.Lock()
+
+    def enable(self, events=True, histograms=True, max_events=MAX_EVENTS, window=HISTOGRAM_WINDOW):
+        self.keep_events = events
+        self.keep_histograms = histograms
+        self.events = deque(self.events, maxlen=max_events)
+        self.window = window
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name, start, duration, args=None):
+        with self._lock:
+            if self.keep_events:
+                event = {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start + self._wall_offset) * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                }
+                if args:
+                    event["args"] = args
+                self.events.append(event)
+            if self.keep_histograms:
+                self.durations[name].append(duration)
+
+    def drain(self):
+        # Hands the collected events to another process (see merge)
+        with self._lock:
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+    def merge(self, events):
+        with self._lock:
+            for event in events:
+                if self.keep_events:
+                    self.events.append(event)
+                if self.keep_histograms:
+                    self.durations[event["name"]].append(event["dur"] / 1e6)
+
+    def chrome_trace(self):
+        with self._lock:
+            events = list(self.events)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self):
+        with self._lock:
+            durations = {name: np.array(values) * 1000 for name, values in self.durations.items() if values}
+        summary = {}
+        for name, values in sorted(durations.items()):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[name] = {"count": len(values), "mean_ms": float(values.mean()),
+                             "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+        return summary
+
+    def format_summary(self):
+        lines = [f"{'span':<32}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        for name, s in self.summary().items():
+            lines.append(f"{name:<32}{s['count']:>8}{s['mean_ms']:>10.3f}{s['p50_ms']:>10.3f}"
+                         f"{s['p95_ms']:>10.3f}{s['p99_ms']:>10.3f}")
+        return "\n".join(lines)
+
+    def dump(self, path=None):
+        # Prints the rolling histogram and writes the trace if a path is given
+        if path:
+            self.export(path)
+        print(self.format_summary(), file=sys.stderr)
+
+
+tracer = Tracer()
+span = tracer.span
+
+
+def traced(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def enable_from_args(path=None, dump_signal=True):
+    # Called by entry points only: trace to `path` (or $PROTOTYPE_TRACE), write
+    # it at exit and dump the summary on SIGUSR1 while running. Forked workers
+    # inherit the handlers, so only the process that enabled tracing writes.
+    path = path or os.environ.get(TRACE_ENV)
+    if not path:
+        return
+    tracer.enable()
+    owner = os.getpid()
+
+    def dump():
+        if os.getpid() == owner:
+            tracer.dump(path)
+
+    atexit.register(dump)
+    if dump_signal and hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, lambda signum, frame: dump())
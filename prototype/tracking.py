@@ -0,0 +1,221 @@
+import numpy as np
+import cv2
+
+from detection import VEHICLE_CLASSES, Detections, empty_detections
+from tracing import span
+
+KEYFRAME_INTERVAL = 10
+TRACK_IOU_THRESHOLD = 0.3
+# Keyframes a track may go unmatched before it is dropped
+MAX_MISSED = 2
+# Keyframe hits before a track is counted, so a box that flickers on for
+# one keyframe or a track that broke and restarted is not counted twice
+MIN_HITS = 2
+PROPAGATION_MODES = ("flow", "hold")
+
+
+def iou_matrix(a, b):
+    # Pairwise IoU between N and M boxes (x1 y1 x2 y2)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+class IoUTracker:
+    # Associates keyframe detections with existing tracks by greedy IoU
+    # matching within each class. Tracks hold numpy rows rather than
+    # objects so propagating every box between keyframes is one array op.
+    def __init__(self, names, iou_threshold=TRACK_IOU_THRESHOLD, max_missed=MAX_MISSED, min_hits=MIN_HITS):
+        self.names = names
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.min_hits = min_hits
+        self.reset()
+
+    def reset(self):
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.confidences = np.zeros(0, dtype=np.float32)
+        self.class_ids = np.zeros(0, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.missed = np.zeros(0, dtype=np.int64)
+        self.next_id = 0
+        # Unique confirmed tracks per class id, kept after the tracks end
+        self.confirmed = {}
+
+    def update(self, detections):
+        if detections.names:
+            self.names = detections.names
+        matched_tracks = np.zeros(len(self.ids), dtype=bool)
+        matched_detections = np.zeros(len(detections.boxes), dtype=bool)
+
+        if len(self.ids) and len(detections.boxes):
+            iou = iou_matrix(self.boxes, detections.boxes)
+            iou[self.class_ids[:, None] != detections.class_ids[None, :]] = 0
+            # Greedy: best remaining pair first
+            for flat in np.argsort(-iou, axis=None, kind="stable"):
+                t, d = divmod(int(flat), iou.shape[1])
+                if iou[t, d] < self.iou_threshold:
+                    break
+                if matched_tracks[t] or matched_detections[d]:
+                    continue
+                matched_tracks[t] = matched_detections[d] = True
+                self.boxes[t] = detections.boxes[d]
+                self.confidences[t] = detections.confidences[d]
+                self.hits[t] += 1
+                self.missed[t] = 0
+
+        self.missed[~matched_tracks] += 1
+        keep = self.missed <= self.max_missed
+        new = ~matched_detections
+        n = int(new.sum())
+        self.boxes = np.concatenate([self.boxes[keep], detections.boxes[new]]).astype(np.float32)
+        self.confidences = np.concatenate([self.confidences[keep], detections.confidences[new]]).astype(np.float32)
+        self.class_ids = np.concatenate([self.class_ids[keep], detections.class_ids[new]]).astype(np.int64)
+        self.ids = np.concatenate([self.ids[keep], np.arange(self.next_id, self.next_id + n)])
+        self.hits = np.concatenate([self.hits[keep], np.ones(n, dtype=np.int64)])
+        self.missed = np.concatenate([self.missed[keep], np.zeros(n, dtype=np.int64)])
+        self.next_id += n
+
+        for track_id, cls in zip(self.ids[self.hits >= self.min_hits], self.class_ids[self.hits >= self.min_hits]):
+            self.confirmed.setdefault(int(cls), set()).add(int(track_id))
+
+    def shift(self, offsets):
+        # offsets: N x 2 per-track displacement in pixels
+        self.boxes += np.tile(offsets, 2).astype(np.float32)
+
+    def detections(self):
+        # Tracks seen on the latest keyframe or coasting since, as Detections
+        visible = self.missed == 0
+        if not visible.any():
+            return empty_detections(self.names)
+        return Detections(self.boxes[visible].copy(), self.confidences[visible].copy(),
+                          self.class_ids[visible].copy(), self.names)
+
+    def counts(self, classes=VEHICLE_CLASSES):
+        # Unique tracks per class over the whole stream, not per frame
+        counts = {name: 0 for name in classes}
+        for cls, track_ids in self.confirmed.items():
+            name = self.names.get(cls)
+            if name in counts:
+                counts[name] += len(track_ids)
+        return counts
+
+
+class KeyframeDetector:
+    # Wraps a detector (list of frames -> list of Detections) and only runs
+    # it on keyframes: every `interval` frames, or sooner when the scene
+    # moved more than `motion_threshold` (mean absolute luma change of a
+    # small probe against the last keyframe) or its histogram jumped. In
+    # between, tracked boxes are moved by sparse Lucas-Kanade optical flow
+    # on the probe ("flow") or left where they were ("hold"). interval=1
+    # detects every frame and only adds tracking for the unique counts.
+    # Frames must be passed in stream order.
+    def __init__(self, detector, interval=KEYFRAME_INTERVAL, motion_threshold=None,
+                 scene_change_threshold=0.3, propagation="flow", probe_width=320,
+                 iou_threshold=TRACK_IOU_THRESHOLD, max_missed=MAX_MISSED, min_hits=MIN_HITS):
+        if propagation not in PROPAGATION_MODES:
+            raise ValueError(f"Unknown propagation {propagation!r}, expected one of {PROPAGATION_MODES}")
+        self.detector = detector
+        self.interval = interval
+        self.motion_threshold = motion_threshold
+        self.scene_change_threshold = scene_change_threshold
+        self.propagation = propagation
+        self.probe_width = probe_width
+        self.tracker = IoUTracker(getattr(detector, "names", {}), iou_threshold, max_missed, min_hits)
+        self.frames = 0
+        self.keyframes = 0
+        self._since_keyframe = None
+        self._key_probe = None
+        self._key_hist = None
+        self._previous = None
+        self._scale = 1.0
+
+    @property
+    def imgsz(self):
+        return getattr(self.detector, "imgsz", None)
+
+    @imgsz.setter
+    def imgsz(self, imgsz):
+        self.detector.imgsz = imgsz
+
+    @property
+    def dynamic_imgsz(self):
+        return getattr(self.detector, "dynamic_imgsz", False)
+
+    def _probe(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        self._scale = min(self.probe_width / gray.shape[1], 1.0)
+        if self._scale < 1.0:
+            size = (self.probe_width, max(1, round(gray.shape[0] * self._scale)))
+            gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def _is_keyframe(self, probe):
+        if self._since_keyframe is None or self._since_keyframe + 1 >= self.interval:
+            return True
+        if self._key_probe.shape != probe.shape:
+            return True
+        if self.motion_threshold is not None and cv2.absdiff(probe, self._key_probe).mean() > self.motion_threshold:
+            return True
+        if self.scene_change_threshold is not None:
+            hist = cv2.calcHist([probe], [0], None, [32], [0, 256]).ravel() / probe.size
+            if np.abs(hist - self._key_hist).sum() > self.scene_change_threshold:
+                return True
+        return False
+
+    def _flow(self, probe):
+        # Three by three grid of points inside each box, tracked from the
+        # previous probe; each box moves by the median of its good points
+        tracker = self.tracker
+        n = len(tracker.ids)
+        if n == 0 or self._previous is None:
+            return
+        boxes = tracker.boxes * self._scale
+        grid = np.array([0.25, 0.5, 0.75], dtype=np.float32)
+        gx, gy = np.meshgrid(grid, grid)
+        width = (boxes[:, 2] - boxes[:, 0])[:, None]
+        height = (boxes[:, 3] - boxes[:, 1])[:, None]
+        xs = boxes[:, 0, None] + width * gx.ravel()
+        ys = boxes[:, 1, None] + height * gy.ravel()
+        points = np.stack([xs, ys], axis=-1).reshape(-1, 1, 2).astype(np.float32)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._previous, probe, points, None,
+                                                    winSize=(15, 15), maxLevel=2)
+        delta = (moved - points).reshape(n, 9, 2)
+        good = status.reshape(n, 9).astype(bool)
+        delta[~good] = np.nan
+        # Boxes that lost every point stay where they are
+        delta[~good.any(axis=1)] = 0
+        offsets = np.nanmedian(delta, axis=1) / self._scale
+        tracker.shift(offsets)
+
+    def detect_one(self, frame):
+        self.frames += 1
+        with span("tracking.probe"):
+            probe = self._probe(frame)
+        if self._is_keyframe(probe):
+            with span("tracking.keyframe"):
+                detections = self.detector([frame])[0]
+                self.tracker.update(detections)
+            self.keyframes += 1
+            self._since_keyframe = 0
+            self._key_probe = probe
+            self._key_hist = cv2.calcHist([probe], [0], None, [32], [0, 256]).ravel() / probe.size
+        else:
+            self._since_keyframe += 1
+            if self.propagation == "flow":
+                with span("tracking.flow"):
+                    self._flow(probe)
+        self._previous = probe
+        return self.tracker.detections()
+
+    def __call__(self, frames):
+        return [self.detect_one(frame) for frame in frames]
+
+    def counts(self, classes=VEHICLE_CLASSES):
+        return self.tracker.counts(classes)
@@ -0,0 +1,103 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Cancelled(Exception):
+    pass
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+
+    def check(self):
+        # Called by jobs between stages; stops a job that is no longer wanted
+        if self._event.is_set():
+            raise Cancelled()
+
+
+class BackgroundWorker:
+    # Runs one job at a time off the Tk main thread. Submitting a new job
+    # cancels the previous one. Jobs are called as job(token, post, *args)
+    # and may call post(kind, value) to hand partial results to the UI;
+    # everything is delivered on the Tk thread by polling with widget.after().
+    # Results of cancelled jobs are dropped.
+    def __init__(self, widget, executor=None, poll_ms=30):
+        self.widget = widget
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.poll_ms = poll_ms
+        self._results = queue.Queue()
+        self._token = None
+        self._callbacks = None
+        self._polling = False
+
+    @property
+    def busy(self):
+        return self._token is not None
+
+    def submit(self, job, *args, on_update=None, on_done=None, on_error=None):
+        self.cancel()
+        token = CancelToken()
+        self._token = token
+        self._callbacks = (on_update, on_done, on_error)
+
+        def post(kind, value=None):
+            if not token.cancelled:
+                self._results.put((token, "update", (kind, value)))
+
+        def run():
+            try:
+                token.check()
+                result = job(token, post, *args)
+            except Cancelled:
+                return
+            except Exception as e:
+                self._results.put((token, "error", e))
+            else:
+                self._results.put((token, "done", result))
+
+        self.executor.submit(run)
+        if not self._polling:
+            self._polling = True
+            self.widget.after(self.poll_ms, self._poll)
+        return token
+
+    def cancel(self):
+        if self._token is not None:
+            self._token.cancel()
+        self._token = None
+        self._callbacks = None
+
+    def _poll(self):
+        while True:
+            try:
+                token, kind, value = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if token is not self._token or token.cancelled:
+                continue
+            on_update, on_done, on_error = self._callbacks
+            if kind == "update":
+                if on_update:
+                    on_update(*value)
+                continue
+            # The job is finished either way
+            self._token = None
+            self._callbacks = None
+            if kind == "done" and on_done:
+                on_done(value)
+            elif kind == "error" and on_error:
+                on_error(value)
+
+        if self._token is not None:
+            self.widget.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False